@@ -1,18 +1,61 @@
-import subprocess
-import json, os
+import sqlite3, subprocess
+import json, os, shlex, tempfile
+import gzip, hashlib, random
+import threading, time, tracemalloc
+from queue import Queue, Empty
 
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, g, render_template, request, redirect, url_for, jsonify
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import desc
+from sqlalchemy import Integer, case, cast, desc, event, func, literal, text
+from sqlalchemy.engine import Engine
 
 
 app = Flask(__name__)
 
-# /// = relative path, //// = absolute path
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite'
+# /// = relative path, //// = absolute path (DATABASE_URI overrides it, see load_test.py)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URI", 'sqlite:///db.sqlite')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, "connect")
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """ unicode_lower: Python str.lower in SQL (SQLite lower() only folds ASCII letters, see get_rating_expression) """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function("unicode_lower", 1, lambda value: value.lower() if isinstance(value, str) else value, deterministic=True)
+
+# Profiling toggle: PROFILE_DIR=../../data/profiles flask run
+# (cProfile file by request, peak memory by route in routes.jsonl, scraper runs with --profile)
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+if PROFILE_DIR is not None:
+    from werkzeug.middleware.profiler import ProfilerMiddleware
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, stream=None, sort_by=("tottime",), restrictions=(25,), profile_dir=PROFILE_DIR)
+    tracemalloc.start()
+
+SCRAPER = "../../notebooks/scraping_jobs.py"
+EVENT_PREFIX = "@event "    # prefix of the events written by the scraper (see emit_event)
+STREAM_RETRY = 1000         # ms before the browser polls /stream again
+STREAM_MAX_JOBS = 200       # jobs sent by /stream response
+SEARCH_PAGE_SIZE = 50       # jobs by /search page
+JOBS_PARAMETERS_JSON = "../../data/jobs_parameters_user_request.json"
+PENDING = "Pending"         # company type and sector of jobs waiting for deferred enrichment
+ENRICH_TOP_N = 20           # jobs enriched in background after a deferred run (best preliminary rating)
+ENRICH_BATCH = 20           # companies by enrichment subprocess
+SEARCH_WEIGHTS = (10.0, 1.0, 5.0, 2.0)   # bm25 weights of job_title, job_summary, job_company, job_company_sector
+RATING_WEIGHTS = {'title': 1, 'company_size_type': 1}   # job rating = sum of weighted ratings (see get_rating_expression)
+TOP_K = 10                  # jobs returned by /top (default)
+TOP_MAX_K = 100             # jobs returned by /top (maximum)
+API_PAGE_SIZE = 100         # jobs by /api/jobs page (default)
+API_MAX_PAGE_SIZE = 1000    # jobs by /api/jobs page (maximum)
+API_FILTERS = ["job_website", "job_company", "job_company_type", "job_company_sector", "job_country_code", "job_city"]   # /api/jobs equality filters
+GZIP_MIN_SIZE = 1024        # responses smaller than this are not compressed
+SEARCHES_DIR = "../../data/searches"    # json jobs parameters of saved search runs
+PLAN_TIMEOUT = 60           # seconds, dry run of the scraper (geocoding, cache checks)
+SCHEDULE_INTERVAL = 24*3600 # seconds between two runs of a saved search
+SCHEDULE_JITTER = 15*60     # seconds, random delay added to each scheduled run
+SCHEDULER_POLL = 30         # seconds between two checks of due saved searches
+RUN_TIMEOUT = 30*60         # seconds without progress before a running run is considered dead
+
 
 class Job(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -28,8 +71,49 @@ class Job(db.Model):
     job_country_code = db.Column(db.String(100))
     job_city = db.Column(db.String(100))
     job_summary = db.Column(db.String(300))
-    job_date = db.Column(db.String(100))
+    job_posted_at = db.Column(db.Integer, index=True)    # UTC timestamp (seconds)
     job_url = db.Column(db.String(100))
+    job_id = db.Column(db.String(100), index=True)    # website job id
+    job_sources = db.Column(db.Text, default="")      # urls of the same job found elsewhere (space separated)
+    job_search = db.Column(db.Integer, index=True)    # saved search (None for /add jobs)
+    job_run = db.Column(db.Integer, index=True)       # run which found the job
+
+    def to_dict(self):
+        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+
+
+class Run(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    run_status = db.Column(db.String(100))  # running, done or failed
+    run_pages_done = db.Column(db.Integer, default=0)
+    run_pages_total = db.Column(db.Integer, default=0)
+    run_jobs = db.Column(db.Integer, default=0)
+    run_started_at = db.Column(db.Float)
+    run_updated_at = db.Column(db.Float)
+    run_search = db.Column(db.Integer, index=True)    # saved search (None for /add runs)
+    run_error = db.Column(db.Text)                    # why the run failed (ex: search rejected by the planner)
+
+    def to_dict(self):
+        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+
+class JobsVersion(db.Model):
+    """ Single row, bumped by triggers in the transaction of every job insert, update or delete (see create_jobs_version) """
+    id = db.Column(db.Integer, primary_key=True)
+    version_number = db.Column(db.Integer, default=0)
+    version_modified_at = db.Column(db.Float)              # UTC timestamp of the last job write
+
+class SavedSearch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    search_name = db.Column(db.String(200))
+    search_parameters = db.Column(db.Text)                # json jobs parameters (same as /add)
+    search_interval = db.Column(db.Integer, default=SCHEDULE_INTERVAL)
+    search_next_run_at = db.Column(db.Float, index=True)
+    search_last_run_id = db.Column(db.Integer)
+    search_last_run_at = db.Column(db.Float)              # start of the last successful run (new postings are posted after)
+
+    def to_dict(self):
+        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+
 
 def get_sorting_values():
     sorting_values = request.form.get("sort")
@@ -72,8 +156,9 @@ def get_title_keywords_ordered():
     title_keywords_ordered = title_keywords_ordered.split(';')
     return title_keywords_ordered
 
-def get_company_size_type():
-    company_size_type_bool = request.form.getlist("company_size_type")
+def get_company_size_type(values=None):
+    values = request.form if values is None else values
+    company_size_type_bool = values.getlist("company_size_type")
     Large_bool, Intermediate_bool, Medium_bool, Small_bool, Startup_bool = False, False, False, False, False
     for size in company_size_type_bool:
         if size == "Large":
@@ -121,71 +206,636 @@ def get_all_information_about_jobs_request():
         'title_keywords_excluded':title_keywords_excluded,
         'pages':pages,
         'title_keywords_ordered':title_keywords_ordered,
-        'company_size_type':company_size_type
+        'company_size_type':company_size_type,
+        'enrichment':get_enrichment()
         }
     return dic
 
+def get_enrichment():
+    enrichment = "deferred" if request.form.get("enrichment") == "deferred" else "inline"
+    return enrichment
+
+def get_rating_weights(values, weights=RATING_WEIGHTS):
+    """ Get rating weights ('weight_title', 'weight_company_size_type' values), default weights otherwise """
+    weights = dict(weights)
+    for rating in RATING_WEIGHTS:
+        weight = values.get("weight_" + rating, type=float)
+        if weight is not None:
+            weights[rating] = weight
+    return weights
+
+def read_jobs_parameters():
+    try:
+        with open(JOBS_PARAMETERS_JSON, "r") as json_file:
+            jobs_parameters = json.load(json_file)
+    except (OSError, ValueError):
+        jobs_parameters = {}
+    return jobs_parameters
+
+
+def create_search_index():
+    """ Create the full-text search index over jobs (SQLite FTS5), kept in sync by triggers """
+    exists = db.session.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='job_fts'")).first()
+    if exists is not None:
+        return
+    statements = [
+        """CREATE VIRTUAL TABLE job_fts USING fts5(job_title, job_summary, job_company, job_company_sector,
+            content='job', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER job_fts_insert AFTER INSERT ON job BEGIN
+            INSERT INTO job_fts(rowid, job_title, job_summary, job_company, job_company_sector)
+            VALUES (new.id, new.job_title, new.job_summary, new.job_company, new.job_company_sector);
+        END""",
+        """CREATE TRIGGER job_fts_delete AFTER DELETE ON job BEGIN
+            INSERT INTO job_fts(job_fts, rowid, job_title, job_summary, job_company, job_company_sector)
+            VALUES ('delete', old.id, old.job_title, old.job_summary, old.job_company, old.job_company_sector);
+        END""",
+        """CREATE TRIGGER job_fts_update AFTER UPDATE ON job BEGIN
+            INSERT INTO job_fts(job_fts, rowid, job_title, job_summary, job_company, job_company_sector)
+            VALUES ('delete', old.id, old.job_title, old.job_summary, old.job_company, old.job_company_sector);
+            INSERT INTO job_fts(rowid, job_title, job_summary, job_company, job_company_sector)
+            VALUES (new.id, new.job_title, new.job_summary, new.job_company, new.job_company_sector);
+        END""",
+        # Index jobs already stored
+        "INSERT INTO job_fts(job_fts) VALUES ('rebuild')",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def add_missing_columns():
+    """ Add columns (and their indexes) created after the tables (db.create_all does not alter tables) """
+    for table in db.metadata.sorted_tables:
+        columns = [row[1] for row in db.session.execute(text("PRAGMA table_info({})".format(table.name))).fetchall()]
+        for column in table.columns:
+            if column.name not in columns:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(text("ALTER TABLE {} ADD COLUMN {} {}".format(table.name, column.name, column_type)))
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    db.session.commit()
+
+def create_jobs_version():
+    """ Create the version row of the job table and its triggers (HTTP validators of the jobs, see get_jobs_validators) """
+    if JobsVersion.query.get(1) is None:
+        db.session.add(JobsVersion(id=1, version_number=0, version_modified_at=time.time()))
+    bump = "UPDATE jobs_version SET version_number = version_number + 1, version_modified_at = (julianday('now') - 2440587.5)*86400.0 WHERE id = 1;"
+    for operation in ["insert", "update", "delete"]:
+        db.session.execute(text("CREATE TRIGGER IF NOT EXISTS job_version_{0} AFTER {1} ON job BEGIN {2} END".format(operation, operation.upper(), bump)))
+    db.session.commit()
+
+def create_tables():
+    db.create_all()
+    add_missing_columns()
+    create_search_index()
+    create_jobs_version()
+
+# Tables, columns and search index are created before the first request (flask run, gunicorn or app.run)
+tables_created = False
+tables_lock = threading.Lock()
+
+@app.before_request
+def create_tables_once():
+    global tables_created
+    with tables_lock:
+        if not tables_created:
+            create_tables()
+            tables_created = True
+
+@app.template_filter("days_ago")
+def days_ago(posted_at):
+    """ Display publication timestamp as 'NN day ago' (computed when the page is rendered) """
+    if posted_at is None:
+        return ""
+    days = int((time.time() - posted_at) // (24*3600))
+    if days < 1:
+        return "<1 day ago"
+    return "{:02d} day ago".format(days)
+
+@app.template_filter("source_name")
+def source_name(url):
+    """ Display website of a source url ('https://fr.indeed.com/...' -> 'Indeed') """
+    for website in ["Indeed", "LinkedIn"]:
+        if website.lower() in url.lower():
+            return website
+    return "Link"
+
+def get_ranking(jobs_query):
+    """ Get SQL ordering of the table (ranking selected with /sort) """
+    job = jobs_query.first()
+    ranking = job.job_ranking if job is not None and job.job_ranking in Job.__table__.columns else "id"
+    if ranking == "job_posted_at":
+        return desc(Job.job_posted_at) # most recent first
+    return getattr(Job, ranking)
+
+def get_search_query(query):
+    """ Convert user query into FTS5 query (every word is required, prefix match) """
+    words = query.split()
+    fts_query = " ".join(['"{}"*'.format(word.replace('"', '""')) for word in words])
+    return fts_query
+
+def search_jobs(query, page=1, page_size=SEARCH_PAGE_SIZE):
+    """ Search jobs with the full-text search index
+    Args:
+        query: String, user query
+        page: Integer, page numero (from 1)
+        page_size: Integer, jobs by page
+    Returns:
+        jobs: Array of Job, jobs ranked by relevance
+        nb_jobs: Integer, number of jobs matching the query
+    """
+    fts_query = get_search_query(query)
+    if fts_query == "":
+        return [], 0
+
+    nb_jobs = db.session.execute(text("SELECT count(*) FROM job_fts WHERE job_fts MATCH :query"), {"query": fts_query}).scalar()
+    rows = db.session.execute(text(
+        "SELECT rowid FROM job_fts WHERE job_fts MATCH :query ORDER BY bm25(job_fts, {}) LIMIT :limit OFFSET :offset".format(
+            ", ".join([str(weight) for weight in SEARCH_WEIGHTS]))),
+        {"query": fts_query, "limit": page_size, "offset": (page - 1) * page_size}).fetchall()
+
+    # Keep relevance order
+    ids = [row[0] for row in rows]
+    jobs_by_id = {job.id: job for job in Job.query.filter(Job.id.in_(ids)).all()}
+    jobs = [jobs_by_id[job_id] for job_id in ids if job_id in jobs_by_id]
+    return jobs, nb_jobs
+
+def get_last_run():
+    run = Run.query.filter(Run.run_search.is_(None)).order_by(desc(Run.id)).first()
+    return run
+
+def touch_last_run():
+    """ Update the last run modification time (jobs changed outside of the scraper: re-rank, sort, delete...) """
+    run = get_last_run()
+    if run is not None:
+        run.run_updated_at = time.time()
+        db.session.commit()
 
-
-@app.route("/")
-def home():
+def get_jobs_validators():
+    """ Get validators of the job table from its version row (same validators in every process, see create_jobs_version)
+    Returns:
+        etag: String, entity tag of the job table for the current request query string
+        last_modified: Float, UTC timestamp of the last modification
+    """
+    jobs_version = JobsVersion.query.get(1)
+    version_number, last_modified = (jobs_version.version_number, jobs_version.version_modified_at) if jobs_version is not None else (0, 0)
+    version = "{}-{}".format(version_number, request.query_string.decode())
+    etag = hashlib.sha1(version.encode()).hexdigest()
+    return etag, last_modified
+
+def is_not_modified(etag, last_modified):
+    """ Check request conditional headers (If-None-Match first, then If-Modified-Since) """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+def compress_response(response):
+    """ Gzip response body if the client accepts it """
+    response.vary.add("Accept-Encoding")
+    if "gzip" not in request.accept_encodings or response.direct_passthrough or response.content_length < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+def get_api_jobs_query(args):
+    """ Get jobs query of /api/jobs from its arguments
+    Args:
+        args: MultiDict, request arguments (filters: API_FILTERS columns, days, min_rating, cursor: after)
+    Returns:
+        jobs_query: Query, filtered jobs ordered by id
+    """
+    jobs_query = Job.query
+    for column in API_FILTERS:
+        values = args.getlist(column)
+        if len(values) > 0:
+            jobs_query = jobs_query.filter(getattr(Job, column).in_(values))
+
+    days = args.get("days", type=int)
+    if days is not None:
+        jobs_query = jobs_query.filter(Job.job_posted_at >= time.time() - days*24*3600)
+    min_rating = args.get("min_rating", type=float)
+    if min_rating is not None:
+        jobs_query = jobs_query.filter(Job.job_rating >= min_rating)
+
+    # Cursor pagination: jobs after the last job id of the previous page (primary key range scan)
+    after = args.get("after", 0, type=int)
+    jobs_query = jobs_query.filter(Job.id > after).order_by(Job.id)
+    return jobs_query
+
+def add_jobs(data, run):
+    # Saved search: jobs found by a previous run are not stored again (delta)
+    known_ids = set()
+    if run.run_search is not None:
+        job_ids = [str(job['Job_id']) for job in data]
+        known_ids = set([job_id for job_id, in db.session.query(Job.job_id).filter(Job.job_search == run.run_search, Job.job_id.in_(job_ids))])
+
+    for job in data:
+        if str(job['Job_id']) in known_ids:
+            continue
+        run.run_jobs += 1
+        new_job = Job(job_ranking="id",
+                    job_index=job.get('index', run.run_jobs),
+                    job_rating=job['General rating'],
+                    job_website=job['Website'],
+                    job_title=job['Title'],
+                    job_company=job['Company'],
+                    job_company_type=job['Company_type'],
+                    job_company_sector=job['Company_sector'],
+                    job_country=job['Country'],
+                    job_country_code=job['Country_code'],
+                    job_city=job['City'],
+                    job_summary=job['Summary'],
+                    job_posted_at=int(job['Posted_at']),
+                    job_url=job['Job_url'],
+                    job_id=str(job['Job_id']),
+                    job_sources=job.get('Sources') or "",
+                    job_search=run.run_search,
+                    job_run=run.id
+                    )
+        db.session.add(new_job)
+    db.session.commit()
+
+def update_sources(data, run):
+    for job in data:
+        Job.query.filter_by(job_id=str(job['Job_id']), job_search=run.run_search).update({"job_sources": job['Sources']})
+    db.session.commit()
+
+def run_scraper(run_id, parameters_filename=JOBS_PARAMETERS_JSON, output_filename=None):
+    """ Run scraping jobs python script and store jobs as soon as a page is scrapped
+    Args:
+        run_id: Integer, id of the run
+        parameters_filename: String, json jobs parameters file of the run
+        output_filename: String, csv jobs file of the scraper (scraper default if None)
+    Returns:
+        run_status: String, final status of the run ('done' or 'failed')
+    """
+    command = "{} --stream --parameters {}".format(SCRAPER, shlex.quote(parameters_filename))
+    if output_filename is not None:
+        command += " --output {}".format(shlex.quote(output_filename))
+    if PROFILE_DIR is not None:
+        command += " --profile {}".format(shlex.quote(os.path.join(PROFILE_DIR, "scraper")))
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+    run_status = "failed"
+    with app.app_context():
+        try:
+            run = Run.query.get(run_id)
+            for line in process.stdout:
+                if not line.startswith(EVENT_PREFIX):
+                    print(line, end='')
+                    continue
+
+                event = json.loads(line[len(EVENT_PREFIX):])
+                if event['event'] == 'start':
+                    run.run_pages_total = event.get('pages_total', 0)
+                elif event['event'] == 'jobs':
+                    add_jobs(event['jobs'], run)
+                elif event['event'] == 'sources':
+                    update_sources(event['jobs'], run)
+                elif event['event'] == 'progress':
+                    run.run_pages_done = event['done']
+                    run.run_pages_total = event['total']
+                elif event['event'] == 'plan' and 'error' in event:
+                    run.run_error = event['error'] # search rejected by the planner (the scraper exits with an error)
+                run.run_updated_at = time.time()
+                db.session.commit()
+
+            process.wait()
+            if process.returncode == 0:
+                run_status = "done"
+        finally:
+            # The run never stays 'running' (scraper, event or database error)
+            if process.poll() is None:
+                process.kill()
+            db.session.rollback()
+            Run.query.filter_by(id=run_id).update({Run.run_status: run_status, Run.run_updated_at: time.time()})
+            db.session.commit()
+
+        # Deferred enrichment: companies of the best jobs first, the others on demand
+        jobs = Job.query.filter_by(job_company_type=PENDING).order_by(desc(Job.job_rating), Job.id).limit(ENRICH_TOP_N).all()
+        request_enrichment([job.job_company for job in jobs])
+    return run_status
+
+
+def get_plan(parameters_filename):
+    """ Dry run of the scraper: requests, bytes and wall time by host of a search (trimmed or rejected if oversized)
+    Returns:
+        plan: Dictionary, 'plan' event of the scraper (pages, requested_pages, hosts or error)
+    """
+    command = "{} --dry-run --stream --parameters {}".format(SCRAPER, shlex.quote(parameters_filename))
+    try:
+        output = subprocess.run(command, shell=True, stdout=subprocess.PIPE, universal_newlines=True, timeout=PLAN_TIMEOUT).stdout
+    except subprocess.TimeoutExpired:
+        return {'error': "no plan after {} seconds".format(PLAN_TIMEOUT)}
+    plan = {'error': "no plan (scraper failed)"}
+    for line in output.splitlines():
+        if line.startswith(EVENT_PREFIX):
+            event = json.loads(line[len(EVENT_PREFIX):])
+            if event['event'] == 'plan':
+                plan = event
+    return plan
+
+
+# Saved searches scheduler (one run at a time, staggered and jittered runs)
+# One scheduler thread by worker process: due searches are claimed in the database (see claim_due_search)
+scheduler = None
+scheduler_lock = threading.Lock()
+
+def get_schedule_offset(search):
+    """ Stagger saved searches over their interval (golden ratio sequence of ids, deterministic) """
+    offset = (search.id * 0.6180339887) % 1 * search.search_interval
+    return offset
+
+def claim_due_search(search, now):
+    """ Move the next run of the search and create its run, in one transaction of conditional writes:
+    the search is not claimed if another worker process moved it or started a run since it was read
+    Returns:
+        run_id: Integer, id of the created run (None if the search was not claimed)
+    """
+    # Next run: same time slot of the next interval (searches stay staggered), plus jitter
+    next_run_at = max(search.search_next_run_at + search.search_interval, now) + random.uniform(0, SCHEDULE_JITTER)
+    nb_claimed = SavedSearch.query.filter(SavedSearch.id == search.id, SavedSearch.search_next_run_at == search.search_next_run_at) \
+        .update({SavedSearch.search_next_run_at: next_run_at}, synchronize_session=False)
+    if nb_claimed == 0:
+        db.session.rollback()
+        return None
+
+    # The search row is locked until the commit: no other run can be inserted between the check and the insert
+    result = db.session.execute(text("""INSERT INTO run (run_status, run_pages_done, run_pages_total, run_jobs, run_started_at, run_updated_at, run_search)
+                                        SELECT 'running', 0, 0, 0, :now, :now, :search_id
+                                        WHERE NOT EXISTS (SELECT 1 FROM run WHERE run_status = 'running' AND run_updated_at >= :running_after)"""),
+                                {'now': now, 'search_id': search.id, 'running_after': now - RUN_TIMEOUT})
+    if result.rowcount == 0:
+        db.session.rollback()
+        return None
+    db.session.commit()
+    return result.lastrowid
+
+def run_due_search():
+    """ Run the most overdue saved search, only postings newer than its last run are scraped and stored
+    Returns:
+        run: Run, None if no search is due, a run is already running or another worker process claimed the search
+    """
+    now = time.time()
+    if Run.query.filter(Run.run_status == "running", Run.run_updated_at >= now - RUN_TIMEOUT).count() > 0:
+        return None
+    search = SavedSearch.query.filter(SavedSearch.search_next_run_at <= now).order_by(SavedSearch.search_next_run_at).first()
+    if search is None:
+        return None
+    run_id = claim_due_search(search, now)
+    if run_id is None:
+        return None
+
+    jobs_parameters = json.loads(search.search_parameters)
+    jobs_parameters['posted_after'] = search.search_last_run_at
+    parameters_filename = os.path.join(SEARCHES_DIR, "search_{}.json".format(search.id))
+    os.makedirs(SEARCHES_DIR, exist_ok=True)
+    with open(parameters_filename, "w") as outfile:
+        json.dump(jobs_parameters, outfile, indent=4, separators=(', ', ': '))
+
+    # Run and search are loaded again: the session is removed with the app context of run_scraper
+    search_id = search.id
+    output_filename = os.path.join(SEARCHES_DIR, "search_{}.csv".format(search_id))
+    run_status = run_scraper(run_id, parameters_filename, output_filename)
+    run = Run.query.get(run_id)
+    if run_status == "done":
+        search = SavedSearch.query.get(search_id)
+        search.search_last_run_id = run.id
+        search.search_last_run_at = run.run_started_at
+        db.session.commit()
+    return run
+
+def run_scheduler():
+    """ Scheduler thread: run due saved searches """
+    while True:
+        with app.app_context():
+            try:
+                run_due_search()
+            except Exception as e:
+                print(">> Scheduler error: {}".format(e))
+        time.sleep(SCHEDULER_POLL)
+
+@app.before_request
+def start_scheduler():
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = threading.Thread(target=run_scheduler, daemon=True)
+            scheduler.start()
+
+
+# Deferred company enrichment (one background worker, companies are deduplicated)
+enrichment_queue = Queue()
+enrichment_pending = set()
+enrichment_lock = threading.Lock()
+enrichment_worker = None
+
+def request_enrichment(companies):
+    """ Ask for company type and sector of companies (asynchronous) """
+    global enrichment_worker
+    with enrichment_lock:
+        for company in companies:
+            if company not in enrichment_pending:
+                enrichment_pending.add(company)
+                enrichment_queue.put(company)
+        if enrichment_worker is None or not enrichment_worker.is_alive():
+            enrichment_worker = threading.Thread(target=enrich_companies, daemon=True)
+            enrichment_worker.start()
+
+def get_rating_expression(jobs_parameters, weights=RATING_WEIGHTS):
+    """ SQL expression of the job rating, computed from the stored job features
+    (same rating as rate_jobs in the scraper when every weight is 1)
+    Args:
+        jobs_parameters: Dictionary, contains title_keywords_ordered and company_size_type preferences
+        weights: Dictionary, weight of each rating ('title', 'company_size_type')
+    Returns:
+        rating: SQL expression, job rating (rounded to an integer, weights can be decimal)
+    """
+    # Title rating: one point by preferred keyword found in the title (case folded like rate_title, accents included)
+    title_keywords_ordered = [word.lower() for word in jobs_parameters.get('title_keywords_ordered', []) if len(word) > 0]
+    title_rating = sum([case((func.instr(func.unicode_lower(Job.job_title), word) > 0, 1), else_=0) for word in title_keywords_ordered], literal(0))
+
+    # Company size type rating: one point if the company size type is selected
+    company_size_type = [size for size, selected in jobs_parameters.get('company_size_type', {}).items() if selected is True]
+    company_rating = case((Job.job_company_type.in_(company_size_type), 1), else_=0)
+
+    rating = cast(func.round(weights['title'] * title_rating + weights['company_size_type'] * company_rating), Integer)
+    return rating
+
+def rerank_jobs(jobs_parameters, weights=RATING_WEIGHTS, jobs_query=None):
+    """ Update stored job ratings with one UPDATE statement (no scraping)
+    Args:
+        jobs_parameters: Dictionary, contains title_keywords_ordered and company_size_type preferences
+        weights: Dictionary, weight of each rating ('title', 'company_size_type')
+        jobs_query: Query, jobs to re-rate (all jobs by default)
+    Returns:
+        nb_jobs: Integer, number of re-rated jobs
+    """
+    jobs_query = Job.query if jobs_query is None else jobs_query
+    nb_jobs = jobs_query.update({Job.job_rating: get_rating_expression(jobs_parameters, weights)}, synchronize_session=False)
+    db.session.commit()
+    touch_last_run()
+    return nb_jobs
+
+def enrich_companies():
+    """ Enrichment worker: run the scraper on batches of companies, then update and re-rank their jobs """
+    global enrichment_worker
+    while True:
+        try:
+            companies = [enrichment_queue.get(timeout=60)]
+        except Empty:
+            # Exit decided under the lock: companies requested meanwhile are enriched by this worker
+            with enrichment_lock:
+                if enrichment_queue.empty():
+                    enrichment_worker = None
+                    return
+            continue
+        while len(companies) < ENRICH_BATCH:
+            try:
+                companies.append(enrichment_queue.get_nowait())
+            except Empty:
+                break
+
+        process = None
+        try:
+            command = "{} --enrich {}".format(SCRAPER, " ".join([shlex.quote(company) for company in companies]))
+            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+            with app.app_context():
+                jobs_parameters = read_jobs_parameters()
+                weights = jobs_parameters.get('rating_weights', RATING_WEIGHTS)
+                for line in process.stdout:
+                    if not line.startswith(EVENT_PREFIX):
+                        continue
+                    event = json.loads(line[len(EVENT_PREFIX):])
+                    if event['event'] != 'company':
+                        continue
+                    jobs_query = Job.query.filter_by(job_company=event['company'])
+                    jobs_query.update({Job.job_company_type: event['type'], Job.job_company_sector: event['sector']}, synchronize_session=False)
+                    rerank_jobs(jobs_parameters, weights, jobs_query)
+                process.wait()
+        except Exception as e:
+            print(">> Enrichment of {} companies failed: {}".format(len(companies), e))
+        finally:
+            # Companies not enriched can be requested again (job opened, sort)
+            if process is not None and process.poll() is None:
+                process.kill()
+            with enrichment_lock:
+                enrichment_pending.difference_update(companies)
+
+def format_event(event, data, event_id=None):
+    message = "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+    if event_id is not None:
+        message = "id: {}\n{}".format(event_id, message)
+    return message
+
+
+
+@app.before_request
+def start_route_profile():
+    if PROFILE_DIR is not None:
+        tracemalloc.reset_peak()
+        g.profile_started_at = time.perf_counter()
+
+@app.after_request
+def write_route_profile(response):
+    if PROFILE_DIR is not None:
+        _, peak = tracemalloc.get_traced_memory()
+        route = {'endpoint': request.endpoint, 'path': request.full_path, 'wall': time.perf_counter() - g.profile_started_at, 'peak': peak, 'time': time.time()}
+        with open(os.path.join(PROFILE_DIR, "routes.jsonl"), "a") as f:
+            f.write(json.dumps(route) + "\n")
+    return response
+
+
+def render_home(days=None, **context):
+    """ Render jobs of the last user request (posted in the last days if days is not None) """
     heads = ["ID", "JOB RATING", "WEBSITE", "TITLE", "COMPANY", "COMPANY TYPE", "COMPANY SECTOR", "COUNTRY", "CITY", "JOB SUMMARY", "DATE", "JOB URL"]
-    jobs = Job.query.all()
+    jobs_query = Job.query.filter(Job.job_search.is_(None))
+
+    # Freshness filter (index range scan on job_posted_at)
+    if days is not None:
+        jobs_query = jobs_query.filter(Job.job_posted_at >= time.time() - days*24*3600)
+
+    jobs = jobs_query.order_by(get_ranking(Job.query)).all()
     print("\n\nJOBS IN TABLE:'{}'\n\n".format(jobs))
     # for job in jobs:
     #     db.session.delete(job)
     #     db.session.commit()
-    return render_template("base.html", jobs=jobs, heads=heads)
+    run = get_last_run()
+    run_active = run is not None and run.run_status == "running"
+    last_id = max([job.id for job in jobs]) if len(jobs) > 0 else 0
+    return render_template("base.html", jobs=jobs, heads=heads, run=run, run_active=run_active, last_id=last_id, days=days, saved_searches=get_saved_searches(), **context)
+
+
+@app.route("/")
+def home():
+    return render_home(days=request.args.get("days", type=int))
 
 
 @app.route("/add", methods=["POST"])
 def add():
-    # # Remove BDD
-    jobs = Job.query.all()
-    for job in jobs:
-        db.session.delete(job)
-        db.session.commit()
+    # # Remove BDD (one statement and one commit: jobs are not loaded)
+    Job.query.filter(Job.job_search.is_(None)).delete(synchronize_session=False)
+    db.session.commit()
 
     # Retrieve user request
     dic_info = get_all_information_about_jobs_request()
     print('\nJobs parameters user request sent', dic_info,'\n')
 
-    json_test = "../../data/jobs_parameters_user_request.json"
-    with open(json_test, "w") as outfile:
+    with open(JOBS_PARAMETERS_JSON, "w") as outfile:
         json.dump(dic_info, outfile, indent=4, separators=(', ', ': ')) 
     
-    # Run scrapping jobs python script
-    subprocess.call("../../notebooks/scraping_jobs.py", shell=True)
-
-    # Load and display data on user interface
-    json_filename = "../../data/jobs.json"
-    with open(json_filename, "r") as json_file:
-        data = json.load(json_file)
-    
-    print("\n",data[0],"\n")
-    for i in range(len(data)):
-        job = data[i]
-        new_job = Job(job_ranking="id",
-                    job_index=job['index'],
-                    job_rating=job['General rating'],
-                    job_website=job['Website'],
-                    job_title=job['Title'],
-                    job_company=job['Company'],
-                    job_company_type=job['Company_type'],
-                    job_company_sector=job['Company_sector'],
-                    job_country=job['Country'],
-                    job_country_code=job['Country_code'],
-                    job_city=job['City'],
-                    job_summary=job['Summary'],
-                    job_date=job['Date'],
-                    job_url=job['Job_url']
-                    )
-        db.session.add(new_job)
-        db.session.commit()
+    # Run scrapping jobs python script in background, jobs are streamed to the user interface (see /stream)
+    run = Run(run_status="running", run_pages_done=0, run_pages_total=0, run_jobs=0, run_started_at=time.time(), run_updated_at=time.time())
+    db.session.add(run)
+    db.session.commit()
+    threading.Thread(target=run_scraper, args=(run.id,), daemon=True).start()
 
     return redirect(url_for("home"))
 
 
+@app.route("/plan", methods=["POST"])
+def plan():
+    """ Show the request plan of the user request, the search is started by the confirm button (same form) """
+    dic_info = get_all_information_about_jobs_request()
+    # One parameters file by request (concurrent plans never read each other's parameters)
+    with tempfile.NamedTemporaryFile("w", prefix="jobs_parameters_plan_", suffix=".json", delete=False) as outfile:
+        json.dump(dic_info, outfile, indent=4, separators=(', ', ': '))
+    try:
+        plan = get_plan(outfile.name)
+    finally:
+        os.remove(outfile.name)
+
+    # Trimmed searches are confirmed with their trimmed pages
+    plan_form = [(name, value) for name, value in request.form.items(multi=True) if name != "pages"]
+    plan_form.append(("pages", str(plan.get('pages', dic_info['pages']))))
+    return render_home(plan=plan, plan_form=plan_form)
+
+
+@app.route("/stream")
+def stream():
+    """ Server-Sent Events: send jobs stored after the last received one and the run progress.
+    The response is closed right away and the browser reconnects after STREAM_RETRY ms with
+    the Last-Event-ID header, so no thread is held by a waiting client.
+    """
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    if last_id is None:
+        last_id = request.args.get("last_id", 0, type=int)
+
+    jobs = Job.query.filter(Job.id > last_id, Job.job_search.is_(None)).order_by(Job.id).limit(STREAM_MAX_JOBS).all()
+    messages = ["retry: {}\n\n".format(STREAM_RETRY)]
+    for job in jobs:
+        messages.append(format_event("job", job.to_dict(), event_id=job.id))
+
+    run = get_last_run()
+    if run is not None:
+        messages.append(format_event("progress", run.to_dict()))
+        if run.run_status != "running" and len(jobs) < STREAM_MAX_JOBS:
+            messages.append(format_event("done", run.to_dict()))
+
+    return Response("".join(messages), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 # @app.route("/update/<int:job_id>")
 # def update(job_id):
 #     job = Job.query.filter_by(id=job_id).first()
@@ -194,24 +844,146 @@ def add():
 #     return redirect(url_for("home"))
 
 
+@app.route("/search")
+def search():
+    heads = ["ID", "JOB RATING", "WEBSITE", "TITLE", "COMPANY", "COMPANY TYPE", "COMPANY SECTOR", "COUNTRY", "CITY", "JOB SUMMARY", "DATE", "JOB URL"]
+    query = request.args.get("q", "")
+    page = max(request.args.get("page", 1, type=int), 1)
+    jobs, nb_jobs = search_jobs(query, page=page)
+    nb_pages = (nb_jobs + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    search = {"query": query, "page": page, "nb_pages": nb_pages, "nb_jobs": nb_jobs}
+    return render_template("base.html", jobs=jobs, heads=heads, run=None, run_active=False, last_id=0, search=search)
+
+
 @app.route("/delete", methods=["POST"])
 def delete():
-    jobs = Job.query.all()
-    for job in jobs:
-        db.session.delete(job)
-        db.session.commit()
+    Job.query.filter(Job.job_search.is_(None)).delete(synchronize_session=False)
+    db.session.commit()
+    touch_last_run()
+    return redirect(url_for("home"))
+
+
+
+@app.route("/rerank", methods=["POST"])
+def rerank():
+    """ Re-rank stored jobs with new preferences (title keywords, company size type, weights) """
+    jobs_parameters = read_jobs_parameters()
+    jobs_parameters['title_keywords_ordered'] = get_title_keywords_ordered()
+    jobs_parameters['company_size_type'] = get_company_size_type()
+    jobs_parameters['rating_weights'] = get_rating_weights(request.form, jobs_parameters.get('rating_weights', RATING_WEIGHTS))
+    with open(JOBS_PARAMETERS_JSON, "w") as outfile:
+        json.dump(jobs_parameters, outfile, indent=4, separators=(', ', ': '))
+
+    nb_jobs = rerank_jobs(jobs_parameters, jobs_parameters['rating_weights'])
+    print("\nJobs re-ranked: '{}'\n".format(nb_jobs))
+    return redirect(url_for("home"))
+
+
+@app.route("/top")
+def top():
+    """ Top-k jobs for preferences given in the query string (stored ratings are not modified)
+    ?k=10&title_keywords_ordered=data;python&company_size_type=Startup&weight_title=2
+    """
+    k = min(max(request.args.get("k", TOP_K, type=int), 1), TOP_MAX_K)
+    jobs_parameters = read_jobs_parameters()
+    if "title_keywords_ordered" in request.args:
+        jobs_parameters['title_keywords_ordered'] = request.args["title_keywords_ordered"].split(';')
+    if "company_size_type" in request.args:
+        jobs_parameters['company_size_type'] = get_company_size_type(request.args)
+    weights = get_rating_weights(request.args, jobs_parameters.get('rating_weights', RATING_WEIGHTS))
+
+    rating = get_rating_expression(jobs_parameters, weights).label("rating")
+    rows = db.session.query(Job, rating).order_by(desc(rating), Job.id).limit(k).all()
+    jobs = [dict(job.to_dict(), job_rating=job_rating) for job, job_rating in rows]
+    return jsonify(jobs)
+
+
+@app.route("/api/jobs")
+def api_jobs():
+    """ JSON list of jobs
+    ?fields=job_title,job_company&job_website=Indeed&days=7&min_rating=1&limit=100&after=<next_cursor>
+    Responses are gzipped and carry ETag/Last-Modified validators of the last run (304 if nothing changed).
+    """
+    etag, last_modified = get_jobs_validators()
+    if is_not_modified(etag, last_modified):
+        response = Response(status=304)
+    else:
+        fields = [field for field in request.args.get("fields", "").split(",") if field in Job.__table__.columns]
+        columns = [Job.id] + [getattr(Job, field) for field in fields if field != "id"] if len(fields) > 0 else list(Job.__table__.columns)
+        limit = min(max(request.args.get("limit", API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+
+        rows = get_api_jobs_query(request.args).with_entities(*columns).limit(limit + 1).all()
+        jobs = [row._asdict() for row in rows[:limit]]
+        next_cursor = jobs[-1]["id"] if len(rows) > limit else None
+        response = compress_response(jsonify({"jobs": jobs, "next_cursor": next_cursor}))
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True   # clients revalidate on each poll
+    return response
+
+
+def get_saved_searches():
+    """ Get saved searches with the number of jobs found by their last run """
+    saved_searches = SavedSearch.query.order_by(SavedSearch.id).all()
+    for search in saved_searches:
+        search.nb_new_jobs = Job.query.filter_by(job_run=search.search_last_run_id).count() if search.search_last_run_id is not None else 0
+    return saved_searches
+
+
+@app.route("/searches", methods=["POST"])
+def save_search():
+    """ Save the user request, it is run by the scheduler (see run_due_search) """
+    dic_info = get_all_information_about_jobs_request()
+    search = SavedSearch(search_name="{} ({})".format(dic_info['query'], ", ".join(dic_info['location'])), search_parameters=json.dumps(dic_info), search_interval=SCHEDULE_INTERVAL)
+    db.session.add(search)
+    db.session.commit()
+    search.search_next_run_at = time.time() + get_schedule_offset(search) + random.uniform(0, SCHEDULE_JITTER)
+    db.session.commit()
     return redirect(url_for("home"))
 
 
+@app.route("/searches/<int:id>")
+def saved_search(id):
+    """ Jobs found by the last run of a saved search (new postings, served from the database) """
+    heads = ["ID", "JOB RATING", "WEBSITE", "TITLE", "COMPANY", "COMPANY TYPE", "COMPANY SECTOR", "COUNTRY", "CITY", "JOB SUMMARY", "DATE", "JOB URL"]
+    search = SavedSearch.query.get_or_404(id)
+    jobs = Job.query.filter_by(job_run=search.search_last_run_id).order_by(desc(Job.job_rating), Job.id).all() if search.search_last_run_id is not None else []
+    return render_template("base.html", jobs=jobs, heads=heads, run=None, run_active=False, last_id=0, saved_searches=get_saved_searches(), saved_search=search)
+
+
+@app.route("/searches/<int:id>/delete", methods=["POST"])
+def delete_search(id):
+    search = SavedSearch.query.get_or_404(id)
+    Job.query.filter_by(job_search=search.id).delete()
+    db.session.delete(search)
+    db.session.commit()
+    touch_last_run()
+    return redirect(url_for("home"))
+
+
+@app.route("/job/<int:id>")
+def open_job(id):
+    """ Open job offer (its company is enriched on demand) """
+    job = Job.query.get_or_404(id)
+    if job.job_company_type == PENDING:
+        request_enrichment([job.job_company])
+    return redirect(job.job_url)
+
 
 @app.route("/sort", methods=["POST"])
 def sort():
     sorting_values = get_sorting_values()
-    print(f"\nsorting_values: '{sorting_valuSes}'\n")
-    jobs = Job.query.all()
-    for job in jobs:
-        job.job_ranking = sorting_values
-        db.session.commit()
+    print(f"\nsorting_values: '{sorting_values}'\n")
+
+    # Sorting by company information needs every company
+    if sorting_values in ["job_company_type", "job_company_sector"]:
+        jobs = Job.query.filter_by(job_company_type=PENDING).all()
+        request_enrichment(sorted(set([job.job_company for job in jobs])))
+
+    Job.query.update({Job.job_ranking: sorting_values}, synchronize_session=False)
+    db.session.commit()
+    touch_last_run()
 
     # new_jobs = Job.query.order_by(sorting_values).all()
     # print("\n\n(SORT) JOBS ORDERED -> new_jobs:'{}'\n\n".format(new_jobs))
@@ -221,7 +993,6 @@ def sort():
 
 
 if __name__ == "__main__":
-    db.create_all()
     app.run(debug=True)
 
 
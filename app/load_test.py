@@ -0,0 +1,288 @@
+""" Load tests of the Flask endpoints
+The database is seeded with synthetic jobs (1k, 10k, 100k rows by default) and the endpoints are driven through
+the WSGI app (Flask test client, one by thread) with a stub scraper. Latency percentiles, throughput and peak memory
+are appended to a results file, and each endpoint is compared with the median of its last results (exit code 1 on regression).
+
+$ python load_test.py --sizes 1000 10000 100000 --concurrency 8 --requests 200
+"""
+import argparse
+import contextlib
+import json, os, random
+import subprocess, sys, tempfile
+import threading, time, tracemalloc
+
+import numpy as np
+
+
+RESULTS_JSONL = "../../data/load_tests.jsonl"
+SIZES = [1000, 10000, 100000]
+CONCURRENCY = 8             # client threads
+READ_REQUESTS = 200         # requests by read endpoint
+WRITE_REQUESTS = 20         # requests by write endpoint (one at a time)
+WRITE_SECONDS = 60          # time budget of the requests by write endpoint and size: fewer requests on the largest databases
+REGRESSION_THRESHOLD = 0.2  # p95 slower by more than 20% than the median p95 of the last results
+REGRESSION_HISTORY = 5      # last results of an endpoint in the median
+REGRESSION_MIN_HISTORY = 3  # fewer last results: endpoint not compared
+REGRESSION_MIN_RESPONSES = 20 # fewer responses of a read endpoint: p95 not compared
+REGRESSION_MIN_WRITE_RESPONSES = 10 # fewer responses of a write endpoint (time budget): p95 not compared
+
+FORM = {"website": "Indeed", "query": "data scientist", "location": "Paris", "distance": "", "title_keywords_must": "",
+        "title_keywords_excluded": "", "pages": "1", "title_keywords_ordered": "data;python", "company_size_type": ["Startup", "Small"]}
+
+# name, method, url, form data
+READ_ENDPOINTS = [
+    ("home", "GET", "/", None),
+    ("home_7_days", "GET", "/?days=7", None),
+    ("api_jobs", "GET", "/api/jobs?limit=100", None),
+    ("search", "GET", "/search?q=data", None),
+    ("top", "GET", "/top?k=10", None),
+]
+WRITE_ENDPOINTS = [
+    ("rerank", "POST", "/rerank", FORM),
+    ("sort", "POST", "/sort", {"sort": "job_company"}),
+]
+# Endpoints deleting the jobs (the database is seeded again before each request)
+RESET_ENDPOINTS = [
+    ("add", "POST", "/add", FORM),
+    ("delete", "POST", "/delete", None),
+]
+
+STUB_SCRAPER = '''
+import json, time
+jobs = [{"Website": "Indeed", "General rating": 1, "Title": "Data scientist %d" % i, "Company": "Company %d" % i,
+         "Company_type": "Unknown", "Company_sector": "Unknown", "Country": "FRANCE", "Country_code": "fr", "City": "Paris",
+         "Summary": "Stub job", "Posted_at": time.time(), "Job_id": "stub%d" % i, "Job_url": "https://example.com", "Sources": ""}
+        for i in range(50)]
+print("@event " + json.dumps({"event": "start"}))
+print("@event " + json.dumps({"event": "jobs", "jobs": jobs}))
+print("@event " + json.dumps({"event": "progress", "done": 1, "total": 1}))
+print("@event " + json.dumps({"event": "done", "total": len(jobs)}))
+'''
+
+WORDS = ["data", "scientist", "engineer", "python", "junior", "senior", "machine", "learning", "analyst", "developer", "cloud", "backend"]
+COMPANY_TYPES = ["Large Enterprise (+5000 employees)", "Intermediate-sized Enterprise (251-5000 employees)", "Medium-sized Enterprise (51-250 employees)",
+                 "Small-sized Enterprise (11-50 employees)", "Startup (1-10 employees)", "Unknown"]
+
+
+def create_test_app(work_dir):
+    """ Import the app with a database, parameters file and stub scraper in work_dir """
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(work_dir, "load_test.sqlite") # never the app database
+    import app as app_module
+    app_module.SEARCHES_DIR = os.path.join(work_dir, "searches")
+    app_module.JOBS_PARAMETERS_JSON = os.path.join(work_dir, "jobs_parameters.json")
+    stub_filename = os.path.join(work_dir, "stub_scraper.py")
+    with open(stub_filename, "w") as f:
+        f.write(STUB_SCRAPER)
+    app_module.SCRAPER = "{} {}".format(sys.executable, stub_filename)
+    app_module.scheduler = threading.Thread() # saved searches scheduler is not started
+    with app_module.app.app_context():
+        app_module.create_tables()
+    return app_module
+
+
+def seed_jobs(app_module, nb_jobs, seed=0):
+    """ Replace the jobs by nb_jobs synthetic jobs (same jobs for the same seed) """
+    generator = random.Random(seed)
+    now = time.time()
+    rows = []
+    for i in range(nb_jobs):
+        title = " ".join(generator.sample(WORDS, 3))
+        rows.append({"job_ranking": "id", "job_index": i, "job_rating": generator.randint(0, 3), "job_website": generator.choice(["Indeed", "LinkedIn"]),
+                     "job_title": title, "job_company": "Company {}".format(generator.randint(0, nb_jobs // 10)), "job_company_type": generator.choice(COMPANY_TYPES),
+                     "job_company_sector": "Sector {}".format(generator.randint(0, 50)), "job_country": "FRANCE", "job_country_code": "fr",
+                     "job_city": generator.choice(["Paris", "Lyon", "Marseille", "Lille"]), "job_summary": " ".join(generator.choices(WORDS, k=30)),
+                     "job_posted_at": int(now - generator.randint(0, 30*24*3600)), "job_url": "https://example.com/{}".format(i),
+                     "job_id": "job{}".format(i), "job_sources": ""})
+    with app_module.app.app_context():
+        db = app_module.db
+        db.session.execute(app_module.Job.__table__.delete())
+        db.session.execute(app_module.Run.__table__.delete())
+        db.session.execute(app_module.Job.__table__.insert(), rows)
+        db.session.add(app_module.Run(run_status="done", run_pages_done=1, run_pages_total=1, run_jobs=nb_jobs, run_started_at=now, run_updated_at=now))
+        db.session.commit()
+
+
+def wait_runs(app_module, timeout=60):
+    """ Wait for the stub scraper runs started by /add """
+    with app_module.app.app_context():
+        end = time.time() + timeout
+        while app_module.Run.query.filter_by(run_status="running").count() > 0 and time.time() < end:
+            time.sleep(0.1)
+
+
+def send(client, method, url, data):
+    """ Send request, returns (latency in seconds, error) """
+    started_at = time.perf_counter()
+    response = client.open(url, method=method, data=data)
+    response.get_data()
+    return time.perf_counter() - started_at, response.status_code >= 400
+
+
+def measure_memory(app_module, method, url, data):
+    """ Peak traced memory of one request (traced apart: tracing slows the requests down) """
+    client = app_module.app.test_client()
+    tracemalloc.start()
+    send(client, method, url, data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run_concurrently(app_module, method, url, data, nb_requests, concurrency):
+    """ Send nb_requests requests from concurrency threads
+    Returns:
+        latencies: Array of floats, seconds
+        nb_errors: Integer, responses with an error status (or exceptions)
+        wall: Float, seconds to send all the requests
+    """
+    latencies, errors = [], []
+    counter = iter(range(nb_requests))
+    lock = threading.Lock()
+
+    def client_thread():
+        client = app_module.app.test_client()
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            try:
+                latency, error = send(client, method, url, data)
+            except Exception:
+                latency, error = None, True
+            with lock:
+                if latency is not None:
+                    latencies.append(latency)
+                errors.append(error)
+
+    threads = [threading.Thread(target=client_thread) for _ in range(concurrency)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors), time.perf_counter() - started_at
+
+
+def summarize(name, size, latencies, nb_errors, wall, concurrency, peak):
+    """ Result of an endpoint at a database size """
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if len(latencies) > 0 else (None, None, None)
+    result = {"endpoint": name, "size": size, "concurrency": concurrency, "responses": len(latencies),
+              "errors": nb_errors, "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+              "throughput_rps": len(latencies) / wall if wall > 0 else None, "peak_kib": peak / 1024}
+    return result
+
+
+def run_load_tests(sizes=SIZES, concurrency=CONCURRENCY, read_requests=READ_REQUESTS, write_requests=WRITE_REQUESTS, write_seconds=WRITE_SECONDS):
+    """ Run load tests of every endpoint at every database size
+    Returns:
+        results: Array of dictionaries, one result by endpoint and size
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, "w") as devnull:
+        app_module = create_test_app(work_dir)
+        for size in sizes:
+            seed_jobs(app_module, size)
+
+            for name, method, url, data in READ_ENDPOINTS:
+                with contextlib.redirect_stdout(devnull):
+                    send(app_module.app.test_client(), method, url, data) # warm up
+                    latencies, nb_errors, wall = run_concurrently(app_module, method, url, data, read_requests, concurrency)
+                    peak = measure_memory(app_module, method, url, data)
+                results.append(summarize(name, size, latencies, nb_errors, wall, concurrency, peak))
+                print_result(results[-1])
+
+            for name, method, url, data in WRITE_ENDPOINTS + RESET_ENDPOINTS:
+                latencies, nb_errors, wall = [], 0, 0.0
+                for i in range(write_requests + 1):
+                    # Last request (memory): after write_requests requests, or once the requests spent the time budget (seeding excluded)
+                    is_last = i == write_requests or wall > write_seconds
+                    if name in [endpoint[0] for endpoint in RESET_ENDPOINTS]:
+                        wait_runs(app_module)
+                        seed_jobs(app_module, size)
+                    with contextlib.redirect_stdout(devnull):
+                        if is_last:
+                            peak = measure_memory(app_module, method, url, data)
+                            break
+                        else:
+                            request_latencies, request_errors, request_wall = run_concurrently(app_module, method, url, data, 1, 1)
+                            latencies += request_latencies
+                            nb_errors += request_errors
+                            wall += request_wall
+                results.append(summarize(name, size, latencies, nb_errors, wall, 1, peak))
+                print_result(results[-1])
+            wait_runs(app_module)
+    return results
+
+
+def print_result(result):
+    print("{:>8} rows  {:<12} p50 {:>9.1f} ms  p95 {:>9.1f} ms  p99 {:>9.1f} ms  {:>8.1f} req/s  {:>9.0f} KiB  {} errors".format(
+        result["size"], result["endpoint"], result["p50_ms"] or 0, result["p95_ms"] or 0, result["p99_ms"] or 0,
+        result["throughput_rps"] or 0, result["peak_kib"], result["errors"]))
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_min_responses(result):
+    """ Fewest responses for a p95 of the result (write endpoints are sent one request at a time, within a time budget) """
+    write_names = [endpoint[0] for endpoint in WRITE_ENDPOINTS + RESET_ENDPOINTS]
+    return REGRESSION_MIN_WRITE_RESPONSES if result["endpoint"] in write_names else REGRESSION_MIN_RESPONSES
+
+
+def find_regressions(results, results_filename, threshold=REGRESSION_THRESHOLD, history=REGRESSION_HISTORY):
+    """ Compare p95 latencies with the median p95 of the last results of the same endpoints and sizes
+    (endpoints with too few responses for a p95 or too few last results are not compared)
+    Returns:
+        regressions: Array of strings, description of the slower endpoints
+    """
+    previous = {}
+    if os.path.isfile(results_filename):
+        with open(results_filename, "r") as f:
+            for line in f:
+                result = json.loads(line)
+                if result["p95_ms"] and result["responses"] >= get_min_responses(result):
+                    previous.setdefault((result["endpoint"], result["size"], result["concurrency"]), []).append(result)
+
+    regressions = []
+    for result in results:
+        last_results = previous.get((result["endpoint"], result["size"], result["concurrency"]), [])[-history:]
+        if len(last_results) < REGRESSION_MIN_HISTORY or not result["p95_ms"] or result["responses"] < get_min_responses(result):
+            continue
+        baseline = float(np.median([last["p95_ms"] for last in last_results]))
+        if result["p95_ms"] > baseline*(1 + threshold):
+            regressions.append("{} ({} rows): p95 {:.1f} ms -> {:.1f} ms (median of {} results, commits {}..{})".format(
+                result["endpoint"], result["size"], baseline, result["p95_ms"], len(last_results), last_results[0]["commit"], last_results[-1]["commit"]))
+    return regressions
+
+
+def save_results(results, results_filename):
+    """ Append results (with date and commit) to the results file """
+    os.makedirs(os.path.dirname(results_filename) or ".", exist_ok=True)
+    commit, now = get_commit(), time.time()
+    with open(results_filename, "a") as f:
+        for result in results:
+            f.write(json.dumps(dict(result, time=now, commit=commit)) + "\n")
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load tests of the Flask endpoints")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of jobs in database (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="client threads of read endpoints (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=READ_REQUESTS, help="requests by read endpoint (default: %(default)s)")
+    parser.add_argument("--write-requests", type=int, default=WRITE_REQUESTS, help="requests by write endpoint (default: %(default)s)")
+    parser.add_argument("--write-seconds", type=float, default=WRITE_SECONDS, help="time budget by write endpoint and size (default: %(default)s)")
+    parser.add_argument("--results", default=RESULTS_JSONL, help="results history file (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="p95 regression threshold (default: %(default)s)")
+    args = parser.parse_args()
+
+    results = run_load_tests(args.sizes, args.concurrency, args.requests, args.write_requests, args.write_seconds)
+    regressions = find_regressions(results, args.results, args.threshold)
+    save_results(results, args.results)
+    for regression in regressions:
+        print(">> REGRESSION {}".format(regression))
+    sys.exit(1 if len(regressions) > 0 else 0)
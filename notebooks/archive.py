@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import argparse
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+#######################################################
+# Jobs archive (append-only Parquet dataset)
+#######################################################
+
+ARCHIVE_DIR = "../../data/archive"
+
+# Files are partitioned by run date and website (data/archive/date=2026-10-19/site=Indeed/run-<run>-0.parquet)
+PARTITION_SCHEMA = pa.schema([('date', pa.string()), ('site', pa.string())])
+
+# Low cardinality columns are dictionary encoded (in memory and in Parquet files)
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+ARCHIVE_SCHEMA = pa.schema([
+    ('run', DICTIONARY),
+    ('run_at', pa.timestamp('s', tz='UTC')),
+    ('General rating', pa.float64()),
+    ('Title', pa.string()),
+    ('Company', pa.string()),
+    ('Company_type', DICTIONARY),
+    ('Company_sector', DICTIONARY),
+    ('Country', DICTIONARY),
+    ('Country_code', DICTIONARY),
+    ('City', DICTIONARY),
+    ('Summary', pa.string()),
+    ('Posted_at', pa.timestamp('s', tz='UTC')),
+    ('Job_id', pa.string()),
+    ('Job_url', pa.string()),
+    ('Sources', pa.string()),
+])
+
+
+def archive_run(df_jobs, run=None, run_at=None, archive_dir=ARCHIVE_DIR):
+    """ Append jobs of a run to the archive (files of previous runs are never modified)
+    Args:
+        df_jobs: Dataframe, contains information about scrapped jobs (see scrape_jobs)
+        run: String, run id (date and process id by default)
+        run_at: Float, timestamp of the run (now by default)
+        archive_dir: String, archive directory
+    Returns:
+        nb_jobs: Integer, number of archived jobs
+    """
+    if len(df_jobs) == 0:
+        return 0
+    run_at = time.time() if run_at is None else run_at
+    run = "{}-{}".format(time.strftime("%Y%m%dT%H%M%S", time.gmtime(run_at)), os.getpid()) if run is None else str(run)
+
+    df = pd.DataFrame({'run': run, 'run_at': pd.Timestamp(int(run_at), unit='s', tz='UTC')}, index=df_jobs.index)
+    for field in ARCHIVE_SCHEMA:
+        if field.name in df_jobs.columns:
+            column = df_jobs[field.name]
+            if field.name == 'Posted_at':
+                column = pd.to_datetime(column, unit='s', utc=True)
+            elif field.type == DICTIONARY or pa.types.is_string(field.type):
+                column = column.astype(str)
+            df[field.name] = column
+    for column in ['Company_type', 'Company_sector', 'Country', 'Country_code', 'City', 'run']:
+        df[column] = df[column].astype('category')
+    df['date'] = time.strftime("%Y-%m-%d", time.gmtime(run_at))
+    df['site'] = df_jobs['Website'].astype(str)
+
+    schema = ARCHIVE_SCHEMA
+    for field in PARTITION_SCHEMA:
+        schema = schema.append(field)
+    table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+    ds.write_dataset(table, archive_dir, format="parquet",
+                     partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"),
+                     basename_template="run-{}-{{i}}.parquet".format(run),
+                     existing_data_behavior="overwrite_or_ignore")
+    print(">> {} jobs archived into '{}'".format(len(df), archive_dir))
+    return len(df)
+
+
+def read_archive(columns, start_date=None, end_date=None, sites=None, filter=None, archive_dir=ARCHIVE_DIR):
+    """ Read archived jobs, only the requested columns are read and the partitions (dates, sites)
+    and Parquet row groups excluded by the filters are skipped
+    Args:
+        columns: Array of strings, columns to read (ARCHIVE_SCHEMA names, 'date' and 'site')
+        start_date: String, first run date ('YYYY-MM-DD')
+        end_date: String, last run date ('YYYY-MM-DD', included)
+        sites: Array of strings, websites
+        filter: Expression, other filter on the archive columns (ex: ds.field('Country_code') == 'fr')
+        archive_dir: String, archive directory
+    Returns:
+        df: Dataframe, archived jobs
+    """
+    expression = filter
+    for condition in [ds.field('date') >= start_date if start_date is not None else None,
+                      ds.field('date') <= end_date if end_date is not None else None,
+                      ds.field('site').isin(sites) if sites is not None else None]:
+        if condition is not None:
+            expression = condition if expression is None else expression & condition
+
+    if not os.path.isdir(archive_dir):
+        return pd.DataFrame(columns=columns)
+    dataset = ds.dataset(archive_dir, format="parquet", partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"))
+    table = dataset.to_table(columns=columns, filter=expression)
+    df = table.to_pandas()
+    return df
+
+
+def aggregate_archive(group_by, aggregations, start_date=None, end_date=None, sites=None, filter=None, archive_dir=ARCHIVE_DIR):
+    """ Aggregate archived jobs (only grouped and aggregated columns are read)
+    Args:
+        group_by: Array of strings, columns to group by
+        aggregations: Dictionary, column -> pandas aggregation ('count', 'nunique', 'mean', 'min', 'max'...)
+        start_date, end_date, sites, filter, archive_dir: see read_archive
+    Returns:
+        df: Dataframe, one row by group
+    """
+    columns = list(dict.fromkeys(group_by + list(aggregations)))
+    df = read_archive(columns, start_date=start_date, end_date=end_date, sites=sites, filter=filter, archive_dir=archive_dir)
+    df = df.groupby(group_by, observed=True).agg(aggregations).reset_index()
+    return df
+
+
+def get_top_companies(nb_companies=20, start_date=None, end_date=None, sites=None, archive_dir=ARCHIVE_DIR):
+    """ Companies with the most distinct postings
+    Args:
+        nb_companies: Integer, number of companies
+        start_date, end_date, sites, archive_dir: see read_archive
+    Returns:
+        df: Dataframe, contains Company and postings columns
+    """
+    df = aggregate_archive(['Company'], {'Job_id': 'nunique'}, start_date=start_date, end_date=end_date, sites=sites, archive_dir=archive_dir)
+    df = df.rename(columns={'Job_id': 'postings'}).sort_values(by='postings', ascending=False).head(nb_companies)
+    return df.reset_index(drop=True)
+
+
+def get_posting_lifetimes(start_date=None, end_date=None, sites=None, archive_dir=ARCHIVE_DIR):
+    """ Time during which postings were found by runs (first and last run of each posting)
+    Args:
+        start_date, end_date, sites, archive_dir: see read_archive
+    Returns:
+        df: Dataframe, contains site, Job_id, first_seen, last_seen and lifetime_days columns
+    """
+    df = read_archive(['site', 'Job_id', 'run_at'], start_date=start_date, end_date=end_date, sites=sites, archive_dir=archive_dir)
+    df = df.groupby(['site', 'Job_id'], observed=True)['run_at'].agg(first_seen='min', last_seen='max').reset_index()
+    df['lifetime_days'] = (df['last_seen'] - df['first_seen']).dt.total_seconds() / (24*3600)
+    return df
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the jobs archive")
+    parser.add_argument('query', choices=['companies', 'lifetimes'], help="companies: most active companies, lifetimes: posting lifetimes summary")
+    parser.add_argument('--start', help="first run date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="last run date (YYYY-MM-DD)")
+    parser.add_argument('--site', action='append', help="website (several possible)")
+    parser.add_argument('--archive', default=ARCHIVE_DIR, help="archive directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.query == 'companies':
+        print(get_top_companies(start_date=args.start, end_date=args.end, sites=args.site, archive_dir=args.archive).to_string(index=False))
+    else:
+        df = get_posting_lifetimes(start_date=args.start, end_date=args.end, sites=args.site, archive_dir=args.archive)
+        print(df.groupby('site', observed=True)['lifetime_days'].describe().to_string())
@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+
+#######################################################
+# Pipeline profiler (CPU, allocations, sampled stacks)
+#######################################################
+
+class Profiler:
+    """ Profile the stages of a run (nothing is measured until start() is called)
+    Every stage has its own cProfile profiler: the time of a nested stage is only counted in the nested stage
+    ('enrich/fetch' is the network wait of the company enrichment). Peak traced memory is kept by stage
+    and the main thread is sampled every `interval` seconds into collapsed stacks (flamegraph.pl, speedscope).
+    Attributes:
+        interval: Float, seconds between two stack samples
+        enabled: Boolean, True between start() and stop()
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.enabled = False
+        self.stack = []
+        self.profiles = {}  # stage -> cProfile.Profile
+        self.stats = {}     # stage -> {'calls':..., 'wall':..., 'peak':...}
+        self.samples = Counter()
+        self.sampler = None
+        self.thread_id = None
+
+    def start(self):
+        """ Start profiling (stages are measured in the calling thread) """
+        self.enabled = True
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        tracemalloc.start()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        """ Stop profiling """
+        self.enabled = False
+        self.sampler.join()
+        self.duration = time.time() - self.started_at
+        tracemalloc.stop()
+
+    def stage(self, name):
+        """ Context manager measuring a stage (no-op when profiling is disabled) """
+        if not self.enabled or threading.get_ident() != self.thread_id:
+            return nullcontext()
+        return self.measure(name)
+
+    @contextmanager
+    def measure(self, name):
+        path = "/".join(self.stack + [name])
+        parent = "/".join(self.stack)
+        self.switch(parent, path)
+        self.stack.append(name)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = self.stats.setdefault(path, {'calls': 0, 'wall': 0.0, 'peak': 0})
+            stats['calls'] += 1
+            stats['wall'] += time.perf_counter() - started_at
+            self.stack.pop()
+            self.switch(path, parent)
+
+    def switch(self, current, following):
+        """ Stop measuring the current stage and start measuring the following one """
+        if current in self.profiles:
+            self.profiles[current].disable()
+        _, peak = tracemalloc.get_traced_memory()
+        if current != "":
+            stats = self.stats.setdefault(current, {'calls': 0, 'wall': 0.0, 'peak': 0})
+            stats['peak'] = max(stats['peak'], peak)
+        tracemalloc.reset_peak()
+        if following != "":
+            self.profiles.setdefault(following, cProfile.Profile()).enable()
+
+    def sample(self):
+        """ Sample the stack of the profiled thread (sampler thread) """
+        while self.enabled:
+            frame = sys._current_frames().get(self.thread_id)
+            functions = []
+            while frame is not None:
+                code = frame.f_code
+                functions.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if len(functions) > 0:
+                stages = ["[{}]".format(stage) for stage in self.stack]
+                self.samples[";".join(stages + functions[::-1])] += 1
+            time.sleep(self.interval)
+
+    def write_report(self, report_dir, top=25):
+        """ Write profiling report files
+        Args:
+            report_dir: String, directory of the report (created)
+            top: Integer, number of functions by stage (self time)
+        Returns:
+            None
+        """
+        os.makedirs(report_dir, exist_ok=True)
+
+        # Stages: calls, wall time (nested stages included) and peak traced memory
+        with open(os.path.join(report_dir, "stages.json"), "w") as f:
+            json.dump({'duration': self.duration, 'stages': self.stats}, f, indent=4, separators=(', ', ': '))
+
+        # Top functions by self time for each stage
+        with open(os.path.join(report_dir, "functions.txt"), "w") as f:
+            f.write("Run duration: {:.2f} s\n\n".format(self.duration))
+            f.write("{:<40} {:>8} {:>10} {:>12}\n".format("STAGE", "CALLS", "WALL (s)", "PEAK (MiB)"))
+            for path, stats in sorted(self.stats.items(), key=lambda item: -item[1]['wall']):
+                f.write("{:<40} {:>8} {:>10.3f} {:>12.1f}\n".format(path, stats['calls'], stats['wall'], stats['peak']/2**20))
+            for path, profile in self.profiles.items():
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).sort_stats('tottime').print_stats(top)
+                f.write("\n\n######## {} ########\n".format(path))
+                f.write(stream.getvalue())
+
+        # Collapsed stacks ('frame;frame;frame count' lines)
+        with open(os.path.join(report_dir, "stacks.folded"), "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+        print(">> Profiling report saved into '{}'".format(report_dir))
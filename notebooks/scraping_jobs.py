@@ -4,7 +4,12 @@
 import pandas as pd 
 import os
  
+import argparse, atexit
 import json, csv
+import hashlib, re, sys, threading, time, unicodedata, zlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from email.utils import formatdate
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
 import requests
 from bs4 import BeautifulSoup
@@ -18,12 +23,44 @@ import webbrowser
 import datetime
 from datetime import date
 
+from task_queue import TaskQueue
+from profiling import Profiler
+
 
 # Global variable
 LI_AT_COOKIE = "ENTER YOUR LI AT COOKIE"
+EVENT_PREFIX = "@event "
+
+# Stages profiler (--profile), stage() does nothing when profiling is disabled
+PROFILE_DIR = "../../data/profiles"
+profiler = Profiler()
+
+# Delta runs: posting dates are relative ('3 days ago'), postings up to this age before the previous run are scraped again
+POSTED_AT_MARGIN = 24*3600
+
+# Adaptive pagination (see PageBudget)
+PAGE_MIN_YIELD = 0.1 # pages of a city stop after a page where less than 10% of the cards are new matching jobs
+PAGE_MAX_FACTOR = 3 # a productive city gets up to 3 times the requested pages (from the pages saved on other cities)
+
+# Company type and sector of jobs waiting for deferred enrichment
+PENDING = "Pending"
+
+# Near-duplicate detection (MinHash signatures of summaries, LSH bands)
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16 # 4 rows by band
+DUPLICATE_THRESHOLD = 0.8 # minimum estimated Jaccard similarity of summaries
+DUPLICATE_TITLE_THRESHOLD = 0.8 # minimum Jaccard similarity of title words (similar summaries)
+
+# GeoId dataset (raw csv, processed artifact rebuilt when the raw csv hash changes)
+GEOID_CSV = "../../data/raw/geoId.csv"
+GEOID_ARTIFACT = "../../data/processed/geoId.parquet"
+GEOID_DTYPES = {'COUNTRY_CODE': 'category', 'COUNTRY': 'category', 'REGION': 'category', 'CITY': str, 'GEO_ID': 'int64'}
+
+# Low cardinality columns of the jobs dataframe (stored as categories)
+JOBS_CATEGORICAL_COLUMNS = ['Website', 'Country', 'Country_code', 'Company_type', 'City']
 
 # Displaying the full text of a pandas DataFrame (with none of its values truncated).
-pd.set_option("display.max_colwidth", -1)
+pd.set_option("display.max_colwidth", None)
 
 
 def convert_csv2json(csv_filename, json_filename):
@@ -68,32 +105,18 @@ def read_data(csv_file):
     return df
 
 
-def transform_address(address, address_type):
-    """ Process data address to country, region and city
+def get_file_hash(filename):
+    """ Get content hash of a file
     Args:
-        address: String, whole address (city, region, country)
-        address_type: String, address type to process
+        filename: String, filename
     Returns:
-        addr: String, processed address (either country, region or city)
+        file_hash: String, sha256 of the file content
     """
-    addr_tab = address.split(",")
-    if len(addr_tab) == 3:
-        
-        if address_type == "CITY":
-            addr = addr_tab[0]
-        elif address_type == "REGION":
-            addr = addr_tab[1]
-        elif address_type == "COUNTRY":
-            addr = addr_tab[2]
-            
-    elif len(addr_tab) == 2:
-        if address_type == "CITY" or address_type == "REGION":
-            addr = addr_tab[0]
-        elif address_type == "COUNTRY":
-            addr = addr_tab[1]
-    else:
-        addr = "None"
-    return addr   
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(partial(f.read, 1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
 
 
 def clean_data(df):
@@ -103,44 +126,57 @@ def clean_data(df):
     Returns:
         df: Dataframe, cleaned dataframe
     """
-    # Create 3 rows with location information
-    df['CITY'] = df['ADDRESS'].apply(transform_address, address_type='CITY')
-    df['REGION'] = df['ADDRESS'].apply(transform_address, address_type='REGION')
-    df['COUNTRY'] = df['ADDRESS'].apply(transform_address, address_type='COUNTRY')
-    
+    # Split addresses once: 'city, region, country' or 'city, country' (region = city)
+    address_tab = df['ADDRESS'].str.split(",", expand=True)
+    nb_parts = df['ADDRESS'].str.count(",") + 1
+    three_parts = nb_parts == 3
+    df['CITY'] = address_tab[0].str.strip()
+    df['REGION'] = address_tab[1].where(three_parts, address_tab[0]).str.strip()
+    df['COUNTRY'] = address_tab[2].where(three_parts, address_tab[1]).str.strip()
+
     # Select columns to process and sort df by country code
-    df = df[['COUNTRY_CODE', 'COUNTRY', 'REGION', 'CITY', 'GEO_ID']].sort_values(by='COUNTRY_CODE')
-    
-    # Remove duplicates, unknowned country code and country
-    df.dropna(subset = ['COUNTRY_CODE'], inplace=True)
-    df = df.drop(df[df['COUNTRY'] == 'None'].index)
-    df = df.drop_duplicates().reset_index()
-    df = df.drop(columns=['index'])
-    
+    df = df.loc[nb_parts.isin([2, 3]), ['COUNTRY_CODE', 'COUNTRY', 'REGION', 'CITY', 'GEO_ID']].sort_values(by='COUNTRY_CODE', kind='stable')
+
+    # Remove duplicates and unknowned country code
+    df = df.dropna(subset=['COUNTRY_CODE'])
+    df = df.drop_duplicates().reset_index(drop=True)
+
+    # Typed columns
+    df = df.astype(GEOID_DTYPES)
     return df
 
 
-def clean_data_geoId(geoId_csv = "../../data/raw/geoId.csv"):
+def clean_data_geoId(geoId_csv=GEOID_CSV, geoId_artifact=GEOID_ARTIFACT):
     """ Clean geoId data for jobs recommendation algorithm
+    (processed artifact is rebuilt only if the raw csv content changed)
     Args:
         geoId_csv: String, csv filename to clean
+        geoId_artifact: String, parquet filename of the processed data (typed columns, raw csv hash in the file metadata)
     Returns:
         df_geoId: Dataframe, contains geoId data
     """
-    # Read geoId data
+    import pyarrow as pa, pyarrow.parquet as pq # only required by LinkedIn (and the archive)
+    raw_hash = get_file_hash(geoId_csv)
+    try:
+        metadata = pq.read_schema(geoId_artifact).metadata or {}
+        if metadata.get(b'raw_hash') == raw_hash.encode('utf-8'):
+            df_geoId = pd.read_parquet(geoId_artifact)
+            print("File '{}' is up to date".format(geoId_artifact))
+            return df_geoId
+    except (OSError, pa.ArrowException):
+        pass
+
+    # Read and clean geoId data
     df = read_data(geoId_csv)
-    
-    # Clean geoId data
     df_geoId = clean_data(df)
-    
-    # Save processed df into csv file
-    geoId_csv_processed = "../../data/processed/geoId.csv"
-    try:
-        df_geoId.to_csv(geoId_csv_processed)
-        print("CSV file '{}' has been cleaned and saved into '{}'".format(geoId_csv, geoId_csv_processed))
-    except:
-        print("Error while saving CSV file  into '{}'".format(geoId_csv_processed))
-        
+
+    # Save processed df with the raw csv hash
+    table = pa.Table.from_pandas(df_geoId, preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata, raw_hash=raw_hash))
+    buffer = pa.BufferOutputStream()
+    pq.write_table(table, buffer)
+    write_file_atomically(geoId_artifact, buffer.getvalue().to_pybytes())
+    print("CSV file '{}' has been cleaned and saved into '{}'".format(geoId_csv, geoId_artifact))
     return df_geoId
 
 
@@ -192,28 +228,16 @@ def remove_elements_end_sentence(sentence):
             sentence = sentence[:-2]
     return sentence
 
-def get_job_title(website, item, jobs_parameters):
-    """ Scrap title
+def check_job_title(job_title, jobs_parameters):
+    """ Check job title with required and excluded keywords
     Args:
-        website: String, website name
-        item: Array of strings, contains HTML elements
+        job_title: String, job title
         jobs_parameters: Dictionay, contains information about user request
     Returns:
-        job_title: String, job title
-        job_title_rating: Integer, job title rating
+        job_title: String, job title ("" if the title is rejected)
     """
-    job_title = ""
     title_keywords_must = [word.lower() for word in jobs_parameters['title_keywords_must']]
     title_keywords_excluded = [word.lower() for word in jobs_parameters['title_keywords_excluded']]
-    
-    if website == 'Indeed':
-        job_title = item.find_all('h2', class_="jobTitle")[0].find_all('span')[-1]
-
-    elif website == 'LinkedIn':
-        job_title = item.find_all('h3', class_="base-search-card__title")[0]
-    
-    # Check valid title and rate title
-    job_title = job_title.text.strip()
     title_tmp = job_title.lower()
 
     # Remove title without must have keywords
@@ -233,174 +257,240 @@ def get_job_title(website, item, jobs_parameters):
     return job_title
 
 
-def get_job_company_name(website, item):
-    """ Scrap job company name
+def get_posted_at(job_date, fetched_at):
+    """ Convert relative job date ('3 days ago', '5 hours ago', 'Posted 30+ days ago', 'Just posted') into timestamp
     Args:
-        website: String, website name
-        item: Array of strings, contains HTML elements
+        job_date: String, relative job date
+        fetched_at: Float, timestamp of the page download
     Returns:
-        job_company_name: String, job company name
+        posted_at: Integer, UTC timestamp of the publication (seconds)
     """
-    job_company_name = ""
-
-    if website == 'Indeed':
-        job_company_name = item.find_all('span', class_="companyName")[0]
-    elif website == 'LinkedIn':
-        job_company_name = item.find_all('h4', class_="base-search-card__subtitle")[0]
-            
-    job_company_name = job_company_name.text.strip().upper()
-    return job_company_name
+    digits = ''.join([digit for digit in job_date if digit.isdigit()])
+    number = int(digits) if digits != '' else 0
+    job_date = job_date.lower()
+
+    seconds = 24*3600 # days by default
+    for unit, unit_seconds in [('minute', 60), ('hour', 3600), ('week', 7*24*3600), ('month', 30*24*3600)]:
+        if unit in job_date:
+            seconds = unit_seconds
+            break
+    posted_at = int(fetched_at - number*seconds)
+    return posted_at
 
 
-def get_job_company_location(website, item):
-    """ Scrap job company location
+def get_delta_age(jobs_parameters):
+    """ Get age of the oldest postings to scrap (delta run of a saved search)
     Args:
-        website: String, website name
-        item: Array of strings, contains HTML elements
+        jobs_parameters: Dictionay, contains information about user request ('posted_after': timestamp of the previous run)
     Returns:
-        job_company_location: String job company location
+        age: Integer, seconds (None for a full run)
     """
-    job_company_location = ""
- 
-    if website == 'Indeed':
-        job_company_location = item.find_all('div', class_="companyLocation")[0]
-    elif website == 'LinkedIn':
-        job_company_location = item.find_all('span', class_="job-search-card__location")[0]
+    if jobs_parameters.get('posted_after') is None:
+        return None
+    age = max(int(time.time() - jobs_parameters['posted_after']), 0) + POSTED_AT_MARGIN
+    return age
 
-    job_company_location = job_company_location.text.strip().split(',')[0]
-    return job_company_location
 
+#######################################################
+# Site adapters
+#######################################################
 
-def get_job_rating(website, item):
-    """ Scrap job rating
-    Args:
-        website: String, website name
-        item: Array of strings, contains HTML elements
-    Returns:
-        job_rating: String job rating
-    """
-    job_rating = ""
-    if website == 'Indeed':
-        try:
-            job_rating = item.find_all('span', class_="ratingNumber")[0].text
-        except:
-            job_rating = ""
-            
-    return job_rating
+# Website name -> site adapter
+SITE_ADAPTERS = {}
 
 
-def get_job_salary(website, item):
-    """ Scrap job salary
-    Args:
-        website: String, website name
-        item: Array of strings, contains HTML elements
-    Returns:
-    """
-    job_salary = ""
-    
-    if website == 'Indeed':
-        try:
-            job_salary = item.find_all('div', class_="metadata salary-snippet-container")[0]
-            job_salary = job_salary.text.strip()
-        except:
-            job_salary = ""
-            
-    return job_salary
-    
-    
-def get_job_summary(website, item):
-    """ Scrap job summary
+def register_site_adapter(adapter_class):
+    """ Register site adapter (class decorator) and precompile its selectors
     Args:
-        website: String, website name
-        item: Array of strings, contains HTML elements
+        adapter_class: Class, SiteAdapter subclass
     Returns:
-        job_summary: String, job summary
+        adapter_class: Class, registered SiteAdapter subclass
     """
-    job_summary = ""
-    
-    if website == 'Indeed':
-        job_summary = item.find_all('div', class_="job-snippet")[0]
-        job_summary = job_summary.text.strip().replace('\n', ' ')
-        
-    elif website == 'LinkedIn':
-        pass
-        
-    return job_summary
+    adapter = adapter_class()
+    adapter.compile_selectors()
+    SITE_ADAPTERS[adapter.website] = adapter
+    return adapter_class
 
-    
-def get_job_date(website, item):
-    """ Scrap job date
+
+def get_site_adapter(website):
+    """ Get registered site adapter
     Args:
         website: String, website name
-        item: Array of strings, contains HTML elements
     Returns:
-        job_date: String, job date
+        adapter: SiteAdapter, adapter of the website
     """
-    job_date = ""
-    
-    if website == 'Indeed':
-        job_date = item.find_all('span', class_='date')[0]
-        
-    elif website == 'LinkedIn':
-        job_date = item.find_all('time')[0]
-    
-    job_date = job_date.text.strip()
-    digits = [digit for digit in job_date if digit.isdigit()]
-    digits = ''.join(digits)
-    
-    if website == 'LinkedIn':
-        if 'minute' in job_date:
-            digits = "<1"
-        elif 'hour' in job_date:
-            digits = "<1"
-        elif 'week' in job_date:
-            digits = 7*int(digits)
-        elif 'month' in job_date:
-            digits = 30*int(digits)
-        else:
-            digits = int(digits)
-       
-    job_date = "{} day ago".format(digits)
-    if not job_date[1].isdigit():
-        job_date = "0{}".format(job_date)
-    return job_date
+    try:
+        adapter = SITE_ADAPTERS[website]
+    except KeyError:
+        raise ValueError("WEBSITE: '{}' is not supported ({})".format(website, ', '.join(SITE_ADAPTERS)))
+    return adapter
 
 
-def get_job_id(website, item):
-    """ Scrap job id
-    Args:
+class SiteAdapter:
+    """ Job board adapter: url builder, card selector and field extractors
+    Attributes:
         website: String, website name
-        item: Array of strings, contains HTML elements
-    Returns:
-        job_id: String, job id
+        field_selectors: Dictionary, {field: (tag, class)} (class None matches any tag)
     """
-    if website == 'Indeed':
-        job_id = item['data-jk']
-    elif website == 'LinkedIn':
-        job_id = item['data-entity-urn'].split(':')[-1]
-    return job_id
+    website = None
+    field_selectors = {}
+
+    def compile_selectors(self):
+        """ Precompile field selectors into {tag: [(classes, field)]} """
+        self.selectors = {}
+        for field, (tag, class_) in self.field_selectors.items():
+            classes = frozenset(class_.split()) if class_ is not None else frozenset()
+            self.selectors.setdefault(tag, []).append((classes, field))
+
+    def extract_fields(self, item):
+        """ Find the first tag of every field in a single traversal of the card
+        Args:
+            item: Soup object, job card
+        Returns:
+            tags: Dictionary, {field: tag}
+        """
+        tags = {}
+        selectors = self.selectors
+        nb_fields = len(self.field_selectors)
+        for tag in item.descendants:
+            tag_selectors = selectors.get(tag.name)
+            if tag_selectors is None:
+                continue
+            tag_classes = tag.get('class') or ()
+            for classes, field in tag_selectors:
+                if field not in tags and classes.issubset(tag_classes):
+                    tags[field] = tag
+            if len(tags) == nb_fields:
+                break
+        return tags
+
+    def get_text(self, tags, field):
+        """ Get text of a field ("" if the card has no tag for it) """
+        return tags[field].text.strip() if field in tags else ""
+
+    def create_url(self, country, city, page, jobs_parameters):
+        raise NotImplementedError
+
+    def find_cards(self, soup):
+        raise NotImplementedError
+
+    def parse_title(self, item, tags):
+        """ Parse job title (the other fields are only parsed for accepted titles, see parse_card)
+        Args:
+            item: Soup object, job card
+            tags: Dictionary, {field: tag} (see extract_fields)
+        Returns:
+            title: String, job title ("" if the card has no title)
+        """
+        raise NotImplementedError
+
+    def parse_card(self, item, tags, url, fetched_at):
+        """ Parse job card, missing fields are empty
+        Args:
+            item: Soup object, job card
+            tags: Dictionary, {field: tag} (see extract_fields)
+            url: String, url of the page
+            fetched_at: Float, timestamp of the page download (relative dates)
+        Returns:
+            card: Dictionary, contains company, location, salary, summary, posted_at, id and url
+        """
+        raise NotImplementedError
+
+
+@register_site_adapter
+class IndeedAdapter(SiteAdapter):
+    website = 'Indeed'
+    field_selectors = {
+        'title': ('h2', "jobTitle"),
+        'company': ('span', "companyName"),
+        'location': ('div', "companyLocation"),
+        'salary': ('div', "metadata salary-snippet-container"),
+        'summary': ('div', "job-snippet"),
+        'date': ('span', "date"),
+    }
 
+    def create_url(self, country, city, page, jobs_parameters):
+        country_code = get_country_code(country) 
+        query = jobs_parameters['query'].replace(' ', '%20')
+        distance = jobs_parameters['distance']
+        page = str(page*10)
+        url = "https://{}.indeed.com/jobs?q={}&l={}&radius={}&start={}&lang=en".format(country_code, query, city, distance, page)
+        age = get_delta_age(jobs_parameters)
+        if age is not None:
+            url += "&fromage={}&sort=date".format(max(1, -(-age // (24*3600)))) # days (rounded up), newest first
+        return url
+
+    def find_cards(self, soup):
+        # No cards container after the last results page (or on a no-results page)
+        whole_jobs = soup.find_all('div', class_=['mosaic-provider-jobcards'])
+        if len(whole_jobs) == 0:
+            return []
+        sample_jobs = whole_jobs[0].find_all('a', class_=['tapItem'])
+        return sample_jobs
 
-def get_job_url(website, item, url, job_id):
-    """ Scrap job url
-    Args:
-        website: String, website name
-        item: Array of strings, contains HTML elements
-    Returns:
-        job_url: String, job url
-    """
-    if website == 'Indeed':
-        try:
-            data_empn = item['data-empn']
-            job_url = "{}&advn={}&vjk={}".format(url, data_empn, job_id)
-        except:
+    def parse_title(self, item, tags):
+        spans = tags['title'].find_all('span') if 'title' in tags else []
+        return spans[-1].text.strip() if len(spans) > 0 else ""
+
+    def parse_card(self, item, tags, url, fetched_at):
+        job_id = item.get('data-jk', "")
+        if item.get('data-empn') is not None:
+            job_url = "{}&advn={}&vjk={}".format(url, item['data-empn'], job_id)
+        else:
             job_url = "{}&vjk={}".format(url, job_id)
-    elif website == 'LinkedIn':
-        try:
-            job_url = item.find_all('a', class_='base-card__full-link')[0]['href']
-        except:
-            job_url = ""
-    return job_url
+
+        card = {
+            'company': self.get_text(tags, 'company').upper(),
+            'location': self.get_text(tags, 'location').split(',')[0],
+            'salary': self.get_text(tags, 'salary'),
+            'summary': self.get_text(tags, 'summary').replace('\n', ' '),
+            'posted_at': get_posted_at(self.get_text(tags, 'date'), fetched_at),
+            'id': job_id,
+            'url': job_url,
+        }
+        return card
+
+
+@register_site_adapter
+class LinkedInAdapter(SiteAdapter):
+    website = 'LinkedIn'
+    field_selectors = {
+        'title': ('h3', "base-search-card__title"),
+        'company': ('h4', "base-search-card__subtitle"),
+        'location': ('span', "job-search-card__location"),
+        'date': ('time', None),
+        'url': ('a', "base-card__full-link"),
+    }
+
+    def create_url(self, country, city, page, jobs_parameters):
+        geoId = find_geoId(city)    
+        query = jobs_parameters['query'].replace(' ', '%20')
+        distance = jobs_parameters['distance']
+        page = str(page*25)
+        url = "https://www.linkedin.com/jobs/search/?geoId={}&keywords={}&location={}%20{}&start={}".format(geoId, query, city, country, page)
+        age = get_delta_age(jobs_parameters)
+        if age is not None:
+            url += "&f_TPR=r{}&sortBy=DD".format(age) # seconds, newest first
+        return url
+
+    def find_cards(self, soup):
+        sample_jobs = soup.find_all(class_="base-card base-card--link base-search-card base-search-card--link job-search-card")
+        return sample_jobs
+
+    def parse_title(self, item, tags):
+        return self.get_text(tags, 'title')
+
+    def parse_card(self, item, tags, url, fetched_at):
+        card = {
+            'company': self.get_text(tags, 'company').upper(),
+            'location': self.get_text(tags, 'location').split(',')[0],
+            'salary': "",
+            'summary': "",
+            'posted_at': get_posted_at(self.get_text(tags, 'date'), fetched_at),
+            'id': item.get('data-entity-urn', "").split(':')[-1],
+            'url': tags['url'].get('href', "") if 'url' in tags else "",
+        }
+        return card
 
 
 def set_company_type(nb_employees):
@@ -435,114 +525,252 @@ def set_company_type(nb_employees):
     return job_company_type
 
 
-def get_job_company_type(website, job_company_name, recurs=2):
-    """ Scrap job company location
+def parse_company_type(soup):
+    """ Parse job company type from LinkedIn company page
     Args:
-        website: String, website name
-        job_company_name: String, company name
+        soup: Soup object, contains company page data
     Returns:
         job_company_type: String job company type
     """
-    job_company_type = ""
-    job_company_name = job_company_name.lower().replace(' ','-').replace('&','and')
-    url = "https://www.linkedin.com/company/{}/about/".format(job_company_name)
-    
-    try:        
-        # Make request with Beautiful Soup (headers='<headers={'cookie': 'li_at=<cookie_li_at_value>'})```>' as explained in the summary)
-        headers = {'cookie': 'li_at={}'.format(LI_AT_COOKIE)}
-        soup = request_bs4(url, headers=headers)
-
-        # Parse data
-        item_tab = soup.find_all('code')
-        nb_employees = 0
-        i = 0
-        while i<len(item_tab) and nb_employees == 0 :
-            item = item_tab[i].text.strip()
-            
-            # Convert object into dictionary
-            item_dic = json.loads(item)
-            
-            # Find the key 'staffCountRange' recursively in the dictionary
-            if isinstance(item_dic, dict):
-                staff_tab = get_field_in_dic_recursively(item_dic, 'staffCountRange')
-                for staff_dic in staff_tab:
-                    
-                     # Find the key 'start' recursively in the dictionary
-                    if isinstance(staff_dic, dict):
-                        start = get_field_in_dic_recursively(staff_dic, 'start')
-                        try:
-                            nb_employees = staff_dic['start']
-
-                            # Try to extract maximum company size ('end' variable)
-                            try:
-                                end = get_field_in_dic_recursively(staff_dic, 'end')[0]
-                                nb_employees = "{}-{}".format(nb_employees, end)
-                            except:
-                                break
-                        except:
-                            pass
-            i+=1
-        # Select company size type 
-        job_company_type = set_company_type(nb_employees)
+    item_tab = soup.find_all('code')
+    nb_employees = 0
+    i = 0
+    while i<len(item_tab) and nb_employees == 0 :
+        item = item_tab[i].text.strip()
         
-    except:
-        job_company_type = "Unknown"
-        if recurs > 0:
-            job_company_name = job_company_name.rsplit('-', 1)[0] # remove last word
-            while job_company_name[-1] == '-':
-                job_company_name = job_company_name[:-1]
-            recurs -= 1
-            job_company_type = get_job_company_type(website, job_company_name, recurs=recurs)
+        # Convert object into dictionary
+        item_dic = json.loads(item)
         
+        # Find the key 'staffCountRange' recursively in the dictionary
+        if isinstance(item_dic, dict):
+            staff_tab = get_field_in_dic_recursively(item_dic, 'staffCountRange')
+            for staff_dic in staff_tab:
+                
+                 # Find the key 'start' recursively in the dictionary
+                if isinstance(staff_dic, dict):
+                    try:
+                        nb_employees = staff_dic['start']
+
+                        # Try to extract maximum company size ('end' variable)
+                        try:
+                            end = get_field_in_dic_recursively(staff_dic, 'end')[0]
+                            nb_employees = "{}-{}".format(nb_employees, end)
+                        except:
+                            break
+                    except:
+                        pass
+        i+=1
+    # Select company size type 
+    job_company_type = set_company_type(nb_employees)
     return job_company_type
 
 
-def get_job_company_sector(website, job_company_name, recurs=2):
-    """ Scrap job company location
+def parse_company_sector(soup):
+    """ Parse job company sector from LinkedIn company page
+    Args:
+        soup: Soup object, contains company page data
+    Returns:
+        job_company_sector: String, job company sector
+    """
+    item_tab = soup.find_all('code')
+    i = 0
+    job_company_sector = ""
+    while i<len(item_tab) and job_company_sector == "":
+        item = item_tab[i].text.strip()
+
+        # Convert object into dictionary
+        item_dic = json.loads(item)
+
+        # Find the key 'specialities' recursively in the dictionary
+        if isinstance(item_dic, dict):
+            sector_tab = get_field_in_dic_recursively(item_dic, 'specialities')
+            for sector in sector_tab:
+                if isinstance(sector, list):
+                    job_company_sector = ', '.join(sector)
+        i+=1
+    return job_company_sector
+
+
+#######################################################
+# Company slug resolution index
+#######################################################
+
+# Company name -> resolved LinkedIn slug (and profile), misses included
+COMPANY_INDEX_JSON = "../../data/company_index.json"
+COMPANY_INDEX_TTL_HIT = 30*24*3600 # seconds
+COMPANY_INDEX_TTL_MISS = 7*24*3600 # seconds
+COMPANY_LEGAL_SUFFIXES = ['inc', 'incorporated', 'ltd', 'limited', 'llc', 'llp', 'plc', 'corp', 'corporation', 'co',
+                          'gmbh', 'ag', 'kg', 'sa', 'sas', 'sasu', 'sarl', 'sca', 'spa', 'srl', 'bv', 'nv', 'ab', 'as', 'oy']
+company_index = None
+company_index_changed = False # resolutions not saved yet (see save_company_index)
+company_index_lock = threading.RLock() # index shared by enrichment and hedged request threads
+
+
+def normalize_company_name(job_company_name, remove_suffixes=False):
+    """ Normalize company name into LinkedIn slug
+    Args:
+        job_company_name: String, company name
+        remove_suffixes: Boolean, remove legal form suffixes (Inc, SAS, GmbH..)
+    Returns:
+        slug: String, normalized company slug
+    """
+    # Remove accents ('Nestl\u00e9' -> 'nestle')
+    name = job_company_name
+    if not name.isascii():
+        name = unicodedata.normalize('NFKD', name)
+        name = ''.join([char for char in name if not unicodedata.combining(char)])
+    name = name.lower()
+    name = name.replace('&', ' and ').replace('+', ' and ').replace('@', ' at ')
+
+    # Remove punctuation ('S.A.' -> 'sa') and split words
+    name = re.sub(r"(?<=\b[a-z])\.", "", name)
+    words = re.sub(r"[^a-z0-9]+", " ", name.replace("'", "")).split()
+    if remove_suffixes:
+        while len(words) > 1 and words[-1] in COMPANY_LEGAL_SUFFIXES:
+            words = words[:-1]
+
+    slug = '-'.join(words)
+    return slug
+
+
+def get_company_slug_candidates(job_company_name, recurs=2):
+    """ Get LinkedIn slugs to try for a company, from the most to the least specific
+    Args:
+        job_company_name: String, company name
+        recurs: Integer, number of times the last word can be removed
+    Returns:
+        slug_tab: Array of strings, slugs to try
+    """
+    slug_tab = [normalize_company_name(job_company_name)]
+    slug = normalize_company_name(job_company_name, remove_suffixes=True)
+    slug_tab.append(slug)
+    while recurs > 0 and '-' in slug:
+        slug = slug.rsplit('-', 1)[0] # remove last word
+        slug_tab.append(slug)
+        recurs -= 1
+
+    # Remove duplicated and empty slugs (keep order)
+    slug_tab = [slug for i, slug in enumerate(slug_tab) if slug != '' and slug not in slug_tab[:i]]
+    return slug_tab
+
+
+def load_company_index(json_filename=COMPANY_INDEX_JSON):
+    """ Load company index from json file
+    Args:
+        json_filename: String, json filename
+    Returns:
+        company_index: Dictionary, contains resolved companies ({NAME:{'slug':..., 'type':..., 'sector':..., 'timestamp':...}})
+    """
+    global company_index
+    with company_index_lock:
+        if company_index is None:
+            try:
+                with open(json_filename, "r") as json_file:
+                    company_index = json.load(json_file)
+            except:
+                company_index = {}
+    return company_index
+
+
+def save_company_index(json_filename=COMPANY_INDEX_JSON):
+    """ Save company index into json file if companies were resolved since the last save (once by page, task or run)
+    Args:
+        json_filename: String, json filename
+    Returns:
+        None
+    """
+    global company_index_changed
+    with company_index_lock:
+        if not company_index_changed:
+            return
+        company_index_changed = False
+        try:
+            tmp_filename = "{}.tmp".format(json_filename)
+            with open(tmp_filename, "w") as json_file:
+                json.dump(load_company_index(json_filename), json_file, indent=4, separators=(', ', ': '))
+            os.replace(tmp_filename, json_filename)
+        except:
+            print(">> Error while saving file '{}'".format(json_filename))
+
+
+def resolve_company(job_company_name):
+    """ Resolve company profile (slug, type, sector) with the company index
+    Args:
+        job_company_name: String, company name
+    Returns:
+        company: Dictionary, contains company slug (None if unresolvable), type and sector
+    """
+    global company_index_changed
+    index = load_company_index()
+    key = normalize_company_name(job_company_name)
+    now = time.time()
+
+    # Hits and misses are served from the index until they expire
+    with company_index_lock:
+        company = index.get(key)
+    if company is not None:
+        ttl = COMPANY_INDEX_TTL_HIT if company['slug'] is not None else COMPANY_INDEX_TTL_MISS
+        if now - company['timestamp'] < ttl:
+            return company
+
+    company = {'slug': None, 'type': "Unknown", 'sector': "Unknown", 'timestamp': now}
+    nb_requests = network_requests['company']
+    for slug in get_company_slug_candidates(job_company_name):
+        url = "https://www.linkedin.com/company/{}/about/".format(slug)
+        try:
+            # Make request with Beautiful Soup (headers='<headers={'cookie': 'li_at=<cookie_li_at_value>'})```>' as explained in the summary)
+            headers = {'cookie': 'li_at={}'.format(LI_AT_COOKIE)}
+            soup = request_bs4(url, headers=headers)
+        except HTTPStatusError:
+            # Not a company page (404, redirect to a search or login page): next slug
+            continue
+        except (FetchError, requests.RequestException):
+            # LinkedIn unavailable: company is Unknown for this run only (not saved as a miss)
+            return company
+        try:
+            # Type and sector are parsed from the same page
+            with profiler.stage('company'):
+                company['type'] = parse_company_type(soup)
+                company['sector'] = parse_company_sector(soup)
+            company['slug'] = slug
+            break
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+            # Not a company page (unknown slug): next slug
+            pass
+
+    record_company_stats(network_requests['company'] - nb_requests)
+    with company_index_lock:
+        index[key] = company
+        company_index_changed = True
+    return company
+
+
+def get_job_company_type(website, job_company_name):
+    """ Scrap job company type
+    Args:
+        website: String, website name
+        job_company_name: String, company name
+    Returns:
+        job_company_type: String job company type
+    """
+    job_company_type = resolve_company(job_company_name)['type']
+    return job_company_type
+
+
+def get_job_company_sector(website, job_company_name):
+    """ Scrap job company sector
     Args:
         website: String, website name
         job_company_name: String, company name
     Returns:
         job_company_sector: String, job company sector
     """
-    job_company_sector = ""
-    job_company_name = job_company_name.lower().replace(' ','-').replace('&','and')
-    url = "https://www.linkedin.com/company/{}/about/".format(job_company_name)
-
-    try:        
-        # Make request with Beautiful Soup (headers='<headers={'cookie': 'li_at=<cookie_li_at_value>'})```>' as explained in the summary)
-        headers = {'cookie': 'li_at={}'.format(LI_AT_COOKIE)}
-        soup = request_bs4(url, headers=headers)
-
-        # Parse data
-        item_tab = soup.find_all('code')
-        i = 0
-        job_company_sector = ""
-        while i<len(item_tab) and job_company_sector == "":
-            item = item_tab[i].text.strip()
-
-            # Convert object into dictionary
-            item_dic = json.loads(item)
-
-            # Find the key 'companyType' recursively in the dictionary
-            if isinstance(item_dic, dict):
-                sector_tab = get_field_in_dic_recursively(item_dic, 'specialities')
-                for sector in sector_tab:
-                    if isinstance(sector, list):
-                        job_company_sector = ', '.join(sector)
-            i+=1
-        
-    except:
-        job_company_sector = "Unknown"
-        if recurs > 0:
-            job_company_name = job_company_name.rsplit('-', 1)[0] # remove last word
-            while job_company_name[-1] == '-':
-                job_company_name = job_company_name[:-1]
-            recurs -= 1
-            job_company_sector = get_job_company_sector(website, job_company_name, recurs=recurs)
-        
+    job_company_sector = resolve_company(job_company_name)['sector']
     return job_company_sector
 
+
+geocode_cache = {} # city -> geocoded address (shared by the searches of a process)
+
 def create_countries_dic(city_tab):
     """ Create dictionary with countries and cities
     Args:
@@ -560,8 +788,10 @@ def create_countries_dic(city_tab):
     for city_to_add in city_tab:
         
         # Find country by selected city
-        country_to_add = geocode(city_to_add)
-        country_to_add = str(country_to_add).upper().split(',')[-1]
+        if city_to_add not in geocode_cache:
+            geocode_cache[city_to_add] = str(geocode(city_to_add))
+        country_to_add = geocode_cache[city_to_add]
+        country_to_add = country_to_add.upper().split(',')[-1]
         
         if country_to_add[0] == ' ':
             country_to_add = country_to_add[1:]
@@ -605,156 +835,769 @@ def get_country_code(country):
     return country_code
 
 
-def find_geoId(city, geoId_csv = "../../data/processed/geoId.csv"):
+geoIds = None # city -> geoId (loaded once from the processed artifact)
+
+def find_geoId(city, geoId_csv=GEOID_CSV, geoId_artifact=GEOID_ARTIFACT):
     """
     Args:
         city: String, name of the city to find geoId
-        geoId_csv: String, csv filename where geoIds are stored
+        geoId_csv: String, raw csv filename of geoIds
+        geoId_artifact: String, csv filename where cleaned geoIds are stored (built if missing or outdated, see clean_data_geoId)
     Returns:
         geoId: Integer, geoId of the city
     """
-    df = read_data(geoId_csv)
-    geoId = df[df['CITY'] == city]['GEO_ID'].values[0]
+    global geoIds
+    if geoIds is None:
+        df = clean_data_geoId(geoId_csv, geoId_artifact)
+        df = df.drop_duplicates(subset='CITY') # first city by country code
+        geoIds = dict(zip(df['CITY'], df['GEO_ID']))
+    geoId = geoIds[city]
     return geoId
 
 
-def create_url_indeed(country, city, page, jobs_parameters):
-    """ Create url for indeed scrapping
+#######################################################
+# Fetch resilience (timeouts, run deadline, circuit breakers, hedged requests)
+#######################################################
+
+FETCH_CONNECT_TIMEOUT = 5 # seconds
+FETCH_READ_TIMEOUT = 20 # seconds without receiving data
+RUN_DEADLINE = 20*60 # seconds, pages not fetched before are skipped (--deadline)
+BREAKER_FAILURES = 5 # consecutive failures opening the circuit of a host
+BREAKER_COOLDOWN = 120 # seconds before a trial request on an open circuit
+HEDGE_DELAY = 3.0 # seconds before sending a copy of a slow listing request (None: no hedged requests)
+# Captcha and login wall pages (redirection urls, markers searched in the beginning of the body)
+BLOCK_PAGE_URLS = ['/authwall', '/checkpoint/challenge', '/captcha']
+BLOCK_PAGE_MARKERS = [b'px-captcha', b'h-captcha', b'g-recaptcha', b'cf-chl-', b'<title>Request Blocked']
+BLOCK_PAGE_PREFIX = 64*1024 # bytes
+run_deadline = None # timestamp
+circuit_breakers = {} # host -> CircuitBreaker
+hedge_executor = None
+
+
+class FetchError(Exception):
+    """ Request not sent (open circuit or run deadline exceeded) or refused by the site (throttled, blocked, server error) """
+
+
+class HTTPStatusError(FetchError):
+    """ Response other than 200 or 304 (page not found, redirection...): the body is not the requested page """
+
+
+def is_transient_status(status_code):
+    """ Responses to retry later (not parsed, not cached): throttled (429, LinkedIn 999) or server error """
+    return status_code in (429, 999) or status_code >= 500
+
+
+def is_block_page(response):
+    """ Check if a response is a captcha or login wall page (answered with a 200 status by some sites) """
+    if any([marker in response.url for marker in BLOCK_PAGE_URLS]):
+        return True
+    content = response.content[:BLOCK_PAGE_PREFIX]
+    return any([marker in content for marker in BLOCK_PAGE_MARKERS])
+
+
+class CircuitBreaker:
+    """ Fail fast on a host after BREAKER_FAILURES consecutive failures (timeouts, connection errors, 429 and 5xx),
+    one trial request is let through every BREAKER_COOLDOWN seconds until the host answers again
+    """
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.nb_failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.time() - self.opened_at >= self.cooldown:
+            self.opened_at = time.time() # half-open: next trial after another cooldown
+            return True
+        return False
+
+    def record(self, success):
+        if success:
+            self.nb_failures = 0
+            self.opened_at = None
+        else:
+            self.nb_failures += 1
+            if self.nb_failures >= self.failures:
+                self.opened_at = time.time()
+
+
+def set_run_deadline(seconds):
+    """ Set deadline of the run (None: no deadline)
     Args:
-        country: String, country name
-        city: String, city name
-        page: Integer, page numero
-        jobs_parameters: Dictionay, contains information about user request
+        seconds: Float, run duration from now
+    Returns:
+        None
+    """
+    global run_deadline
+    run_deadline = time.time() + seconds if seconds is not None else None
+
+
+def get_timeout():
+    """ Get request timeout, the read timeout is shortened by the run deadline
     Returns:
+        timeout: Tuple of floats, connect and read timeouts
+    """
+    if run_deadline is None:
+        return (FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT)
+    remaining = run_deadline - time.time()
+    if remaining <= 0:
+        raise FetchError("run deadline exceeded")
+    return (min(FETCH_CONNECT_TIMEOUT, remaining), min(FETCH_READ_TIMEOUT, remaining))
+
+
+def hedged_get(url, headers, timeout, hedge_delay=HEDGE_DELAY):
+    """ GET request copied if no response came after hedge_delay seconds (first response is used)
+    Args:
         url: String, url
+        headers: Dictionary, request headers
+        timeout: Tuple of floats, connect and read timeouts
+        hedge_delay: Float, seconds before sending the copy
+    Returns:
+        response: Response object
     """
-    country_code = get_country_code(country) 
-    query = jobs_parameters['query'].replace(' ', '%20')
-    distance = jobs_parameters['distance']
-    page = str(page*10)
-    url = "https://{}.indeed.com/jobs?q={}&l={}&radius={}&start={}&lang=en".format(country_code, query, city, distance, page)
-    return url
+    global hedge_executor
+    if hedge_executor is None:
+        hedge_executor = ThreadPoolExecutor(max_workers=4)
+    futures = [hedge_executor.submit(requests.get, url, headers=headers, timeout=timeout)]
+    done, _ = wait(futures, timeout=hedge_delay)
+    if len(done) == 0:
+        futures.append(hedge_executor.submit(requests.get, url, headers=headers, timeout=timeout))
+
+    # The slowest request is not cancelled, it ends with its own timeout
+    error = None
+    for future in as_completed(futures):
+        try:
+            return future.result()
+        except requests.RequestException as e:
+            error = e
+    raise error
 
 
-def create_url_linkedin(country, city, page, jobs_parameters):
-    """ Create url for linkedin scrapping
+def http_get(url, headers, hedge=False):
+    """ GET request with timeouts, run deadline and circuit breaker of the host
     Args:
-        country: String, country name
-        city: String, city name
-        page: Integer, page numero
-        jobs_parameters: Dictionay, contains information about user request
+        url: String, url
+        headers: Dictionary, request headers
+        hedge: Boolean, send a copy of the request if it is slow (see hedged_get)
     Returns:
+        response: Response object
+    """
+    host = urlsplit(url).hostname
+    breaker = circuit_breakers.setdefault(host, CircuitBreaker())
+    if not breaker.allow():
+        raise FetchError("circuit open for '{}'".format(host))
+
+    timeout = get_timeout()
+    started_at = time.time()
+    try:
+        if hedge and HEDGE_DELAY is not None:
+            response = hedged_get(url, headers, timeout, hedge_delay=HEDGE_DELAY)
+        else:
+            response = requests.get(url, headers=headers, timeout=timeout)
+    except requests.RequestException:
+        breaker.record(False)
+        raise
+    blocked = response.status_code == 200 and is_block_page(response)
+    breaker.record(not is_transient_status(response.status_code) and not blocked)
+    record_request_stats(url, len(response.content), time.time() - started_at, full=response.status_code == 200 and not blocked)
+    if is_transient_status(response.status_code):
+        raise FetchError("HTTP {} from '{}'".format(response.status_code, host))
+    if blocked:
+        raise FetchError("captcha or login wall from '{}'".format(host))
+    return response
+
+
+#######################################################
+# HTTP response cache
+#######################################################
+
+HTTP_CACHE_DIR = "../../data/cache/http"
+HTTP_CACHE_MAX_SIZE = 200*2**20 # bytes (compressed bodies)
+# (host suffix, path prefix, ttl in seconds), first match is used
+HTTP_CACHE_TTL = [
+    ('linkedin.com', '/company/', 7*24*3600),
+    ('linkedin.com', '/', 6*3600),
+    ('indeed.com', '/', 6*3600),
+]
+HTTP_CACHE_DEFAULT_TTL = 3600
+# Request headers changing the response (part of the cache key)
+HTTP_CACHE_HEADERS = ['cookie', 'accept-language', 'authorization']
+http_cache_size = None
+
+
+def normalize_url(url):
+    """ Normalize url (lowercase scheme and host, sorted query, no fragment)
+    Args:
         url: String, url
+    Returns:
+        url: String, normalized url
     """
-    geoId = find_geoId(city)    
-    query = jobs_parameters['query'].replace(' ', '%20')
-    distance = jobs_parameters['distance']
-    page = str(page*25)
-    url = "https://www.linkedin.com/jobs/search/?geoId={}&keywords={}&location={}%20{}&start={}".format(geoId, query, city, country, page)
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    url = urlunsplit((scheme.lower(), netloc.lower(), path or '/', query, ''))
     return url
 
 
-def request_bs4(url, headers=None):
-    """ Make request with Beautiful Soup
+def get_cache_key(url, headers):
+    """ Get cache key of a request
     Args:
         url: String, url
+        headers: Dictionary, request headers
     Returns:
-        soup: Soup object, contains extracted data
+        key: String, sha256 of the normalized url and the headers changing the response
     """
-    if headers is None:
-        # Use of headers to make HTTP requests
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.82 Safari/537.36'}
-    
-    # Extract data
-    request = requests.get(url, headers=headers)
-    soup = BeautifulSoup(request.content, 'html.parser')
-    
-    return soup
+    headers = {name.lower(): value for name, value in headers.items()}
+    key = [normalize_url(url)] + ["{}:{}".format(name, headers[name]) for name in HTTP_CACHE_HEADERS if name in headers]
+    key = hashlib.sha256("\n".join(key).encode('utf-8')).hexdigest()
+    return key
 
 
-def extract_data(website, country, city, page, jobs_parameters):
-    """ Extract data from website 
+def get_cache_ttl(url):
+    """ Get freshness lifetime of an url
     Args:
-        website: String, website name
-        country: String, country name
-        city: String, city name
-        page: Integer, page numero
-        jobs_parameters: Dictionay, contains information about user request
-    Returns:
         url: String, url
-        soup: Soup object, contains extracted data
+    Returns:
+        ttl: Integer, ttl in seconds
     """
-    # Generate url
-    if website == 'Indeed':
-        url = create_url_indeed(country, city, page, jobs_parameters)
-    elif website == 'LinkedIn':
-        url = create_url_linkedin(country, city, page, jobs_parameters)
-    else:
-        print(f"WEBSITE: '{website}'")
-    # Make request with Beautiful Soup
-    soup = request_bs4(url)
-    return url, soup
-       
+    _, netloc, path, _, _ = urlsplit(url)
+    host = netloc.lower().split(':')[0]
+    for host_suffix, path_prefix, ttl in HTTP_CACHE_TTL:
+        if host.endswith(host_suffix) and path.startswith(path_prefix):
+            return ttl
+    return HTTP_CACHE_DEFAULT_TTL
+
 
-def transform_data(website, country, url, soup, jobs_parameters):
-    """ Create dictionary with job information
+def get_entry_filename(key, cache_dir=HTTP_CACHE_DIR):
+    """ Get metadata filename of a request
     Args:
-        website: String, website name
-        country: String, country name
-        url: String, url
-        soup: Soup object, contains extracted data
-        jobs_parameters: Dictionay, contains information about user request
+        key: String, cache key
+        cache_dir: String, cache directory
     Returns:
-        job_info_tab: Array of strings, contains job information 
+        entry_filename: String, metadata filename (url, validators, body hash)
     """
-    job_info_tab = []
-    
-    if website == 'Indeed':
-        whole_jobs = soup.find_all('div', class_=['mosaic-provider-jobcards'])
-        sample_jobs = whole_jobs[0].find_all('a', class_=['tapItem'])
-        
-    elif website == 'LinkedIn':
-        whole_jobs = soup.find_all(class_="base-card base-card--link base-search-card base-search-card--link job-search-card")
-        sample_jobs = whole_jobs
+    entry_filename = os.path.join(cache_dir, 'entries', key[:2], "{}.json".format(key))
+    return entry_filename
 
-    # Retrieve title, company name, company location, salary, summary, date, id and url
-    for item in sample_jobs:
-        job_title = get_job_title(website, item, jobs_parameters)
-        if job_title != "":
-            job_company_name = get_job_company_name(website, item)
-            job_company_type = get_job_company_type(website, job_company_name)
-            job_company_sector = get_job_company_sector(website, job_company_name)
-            job_company_location = get_job_company_location(website, item)
-            job_salary = get_job_salary(website, item)
-            job_summary = get_job_summary(website, item)
-            job_date = get_job_date(website, item)
-            job_id = get_job_id(website, item)
-            job_url = get_job_url(website, item, url, job_id)
-            
-            country_code = get_country_code(country)
-            
-            # Create dictionary to retrieve data
-            job = {
-                'Title': job_title,
-                'Company': job_company_name,
-                'Company_type': job_company_type,
-                'Company_sector':job_company_sector,
-                'Country': country,
-                'Country_code': country_code,
-                'City': job_company_location,
-                'Salary': job_salary,
-                'Summary': job_summary,
-                'Date': job_date,
-                'Job_id': job_id,
-                'Job_url': job_url                
-            }
+
+def get_body_filename(body_hash, cache_dir=HTTP_CACHE_DIR):
+    """ Get body filename (content-addressed: identical bodies are stored once) """
+    body_filename = os.path.join(cache_dir, 'bodies', body_hash[:2], "{}.z".format(body_hash))
+    return body_filename
+
+
+def write_file_atomically(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_filename, filename)
+
+
+def read_cache(key):
+    """ Read cached response
+    Args:
+        key: String, cache key
+    Returns:
+        entry: Dictionary, contains url, etag, last_modified, fetched_at and body hash (None if not cached)
+        content: Bytes, response body (None if not cached)
+    """
+    entry_filename = get_entry_filename(key)
+    try:
+        with open(entry_filename, 'r') as f:
+            entry = json.load(f)
+        with open(get_body_filename(entry['body']), 'rb') as f:
+            content = zlib.decompress(f.read())
+        os.utime(entry_filename) # last use (LRU eviction)
+    except (OSError, ValueError, zlib.error):
+        return None, None
+    return entry, content
+
+
+def get_cache_status(url, headers):
+    """ Get cache status of a request (without reading its body)
+    Args:
+        url: String, url
+        headers: Dictionary, request headers
+    Returns:
+        status: String, 'fresh' (served from the cache), 'stale' (revalidated) or 'miss'
+        entry: Dictionary, cache entry (None if not cached)
+    """
+    try:
+        with open(get_entry_filename(get_cache_key(url, headers)), 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return 'miss', None
+    status = 'fresh' if time.time() - entry['fetched_at'] < get_cache_ttl(url) else 'stale'
+    return status, entry
+
+
+def write_cache(key, url, response, content):
+    """ Save response into cache
+    Args:
+        key: String, cache key
+        url: String, url
+        response: Response object, response (validators)
+        content: Bytes, response body
+    Returns:
+        entry: Dictionary, contains url, etag, last_modified, fetched_at and body hash
+    """
+    global http_cache_size
+    body_hash = hashlib.sha256(content).hexdigest()
+    body_filename = get_body_filename(body_hash)
+    if not os.path.isfile(body_filename):
+        body = zlib.compress(content, 6)
+        write_file_atomically(body_filename, body)
+        if http_cache_size is not None:
+            http_cache_size += len(body)
+
+    entry = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.time(), # last download or revalidation (freshness)
+        'content_at': time.time(), # last download (relative dates of the page)
+        'body': body_hash,
+    }
+    write_file_atomically(get_entry_filename(key), json.dumps(entry).encode('utf-8'))
+    evict_cache()
+    return entry
+
+
+def evict_cache(cache_dir=HTTP_CACHE_DIR, max_size=HTTP_CACHE_MAX_SIZE):
+    """ Remove least recently used entries until the cache fits into max_size
+    Args:
+        cache_dir: String, cache directory
+        max_size: Integer, maximum size of the bodies (bytes)
+    Returns:
+        None
+    """
+    global http_cache_size
+    bodies_dir = os.path.join(cache_dir, 'bodies')
+    if http_cache_size is None:
+        http_cache_size = sum([entry.stat().st_size for sub_dir in os.scandir(bodies_dir) for entry in os.scandir(sub_dir.path)]) if os.path.isdir(bodies_dir) else 0
+    if http_cache_size <= max_size:
+        return
+
+    # Entries from the least to the most recently used
+    entries_dir = os.path.join(cache_dir, 'entries')
+    entries = []
+    for sub_dir in os.scandir(entries_dir):
+        for entry in os.scandir(sub_dir.path):
+            try:
+                if entry.name.endswith('.json'):
+                    entries.append((entry.stat().st_mtime, entry))
+            except FileNotFoundError:
+                pass # evicted by a concurrent run
+    entries = [entry for _, entry in sorted(entries, key=lambda item: item[0])]
+    bodies = {}
+    for entry in entries:
+        try:
+            with open(entry.path, 'r') as f:
+                bodies[entry.path] = json.load(f)['body']
+        except (OSError, ValueError):
+            bodies[entry.path] = None
+    references = {}
+    for body_hash in bodies.values():
+        references[body_hash] = references.get(body_hash, 0) + 1
+
+    # Bodies of overwritten entries (page changed since the last download) are not referenced anymore
+    # (bodies of the last minute are kept: their entry can be written by another process right now)
+    for sub_dir in os.scandir(bodies_dir):
+        for body in os.scandir(sub_dir.path):
+            body_hash = body.name.split('.')[0]
+            if body_hash not in references and body.name.endswith('.z') and body.stat().st_mtime < time.time() - 60:
+                try:
+                    http_cache_size -= body.stat().st_size
+                    os.remove(body.path)
+                except OSError:
+                    pass
+
+    # Bodies are removed with their last entry (target: 90% of max_size)
+    for entry in entries:
+        if http_cache_size <= 0.9*max_size:
+            break
+        body_hash = bodies[entry.path]
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass # evicted (or replaced) by a concurrent run or batch worker
+        references[body_hash] -= 1
+        if body_hash is not None and references[body_hash] == 0:
+            body_filename = get_body_filename(body_hash, cache_dir)
+            try:
+                http_cache_size -= os.path.getsize(body_filename)
+                os.remove(body_filename)
+            except OSError:
+                pass
+
+
+def fetch_url(url, headers, use_cache=True, hedge=False):
+    """ Get response body, from the cache when it is fresh (revalidated with ETag/Last-Modified when stale)
+    Args:
+        url: String, url
+        headers: Dictionary, request headers
+        use_cache: Boolean, use HTTP response cache
+        hedge: Boolean, send a copy of the request if it is slow
+    Returns:
+        content: Bytes, response body
+        content_at: Float, timestamp of the body download
+    """
+    if not use_cache:
+        response = http_get(url, headers, hedge=hedge)
+        if response.status_code != 200:
+            raise HTTPStatusError("HTTP {} from '{}'".format(response.status_code, url))
+        return response.content, time.time()
+
+    key = get_cache_key(url, headers)
+    entry, content = read_cache(key)
+    if entry is not None and time.time() - entry['fetched_at'] < get_cache_ttl(url):
+        return content, entry.get('content_at', entry['fetched_at'])
+
+    # Conditional request when the site gave validators
+    request_headers = dict(headers)
+    if entry is not None:
+        if entry['etag'] is not None:
+            request_headers['If-None-Match'] = entry['etag']
+        if entry['last_modified'] is not None:
+            request_headers['If-Modified-Since'] = entry['last_modified']
+        elif entry['etag'] is None:
+            request_headers['If-Modified-Since'] = formatdate(entry['fetched_at'], usegmt=True)
+
+    response = http_get(url, request_headers, hedge=hedge)
+    if response.status_code == 304 and entry is not None:
+        entry['fetched_at'] = time.time()
+        write_file_atomically(get_entry_filename(key), json.dumps(entry).encode('utf-8'))
+        return content, entry.get('content_at', entry['fetched_at'])
+
+    if response.status_code != 200:
+        raise HTTPStatusError("HTTP {} from '{}'".format(response.status_code, url))
+    content = response.content
+    write_cache(key, url, response, content)
+    return content, time.time()
+
+
+def request_page(url, headers=None, use_cache=True, hedge=False, memo=None):
+    """ Make request with Beautiful Soup
+    Args:
+        url: String, url
+        headers: Dictionary, request headers
+        use_cache: Boolean, use HTTP response cache
+        hedge: Boolean, send a copy of the request if it is slow
+        memo: Dictionary, url -> (content, fetched_at), responses already downloaded (None to disable)
+    Returns:
+        soup: Soup object, contains extracted data
+        fetched_at: Float, timestamp of the page download
+    """
+    if headers is None:
+        # Use of headers to make HTTP requests
+        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.82 Safari/537.36'}
+    
+    # Extract data
+    if memo is not None and url in memo:
+        content, fetched_at = memo[url]
+    else:
+        with profiler.stage('fetch'):
+            content, fetched_at = fetch_url(url, headers, use_cache=use_cache, hedge=hedge)
+        if memo is not None:
+            memo[url] = (content, fetched_at)
+    with profiler.stage('parse'):
+        soup = BeautifulSoup(content, 'html.parser')
+    
+    return soup, fetched_at
+
+
+def request_bs4(url, headers=None, use_cache=True):
+    """ Make request with Beautiful Soup
+    Args:
+        url: String, url
+        headers: Dictionary, request headers
+        use_cache: Boolean, use HTTP response cache
+    Returns:
+        soup: Soup object, contains extracted data
+    """
+    soup, _ = request_page(url, headers=headers, use_cache=use_cache)
+    return soup
+
+
+class JobRecord:
+    """ Job information scrapped from a card (slotted, no dictionary by job) """
+    __slots__ = ('Title', 'Company', 'Company_type', 'Company_sector', 'Country', 'Country_code', 'City', 'Salary', 'Summary', 'Posted_at', 'Job_id', 'Job_url', 'Sources')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field, ""))
+
+    def to_tuple(self):
+        return tuple([getattr(self, field) for field in self.__slots__])
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+listing_memo = None # url -> (content, fetched_at), listing pages fetched once by batch (see run_batch)
+
+def extract_data(website, country, city, page, jobs_parameters):
+    """ Extract data from website 
+    Args:
+        website: String, website name
+        country: String, country name
+        city: String, city name
+        page: Integer, page numero
+        jobs_parameters: Dictionay, contains information about user request
+    Returns:
+        url: String, url
+        soup: Soup object, contains extracted data
+        fetched_at: Float, timestamp of the page download
+    """
+    # Generate url
+    url = get_site_adapter(website).create_url(country, city, page, jobs_parameters)
+
+    # Make request with Beautiful Soup (listing pages are hedged, identical listing pages of a batch are fetched once)
+    soup, fetched_at = request_page(url, hedge=True, memo=listing_memo)
+    return url, soup, fetched_at
+       
+
+def parse_cards(website, country, url, soup, jobs_parameters, fetched_at=None, stats=None):
+    """ Create job records from the cards of a page (without company information)
+    Args:
+        website: String, website name
+        country: String, country name
+        url: String, url
+        soup: Soup object, contains extracted data
+        jobs_parameters: Dictionay, contains information about user request
+        fetched_at: Float, timestamp of the page download (now if None)
+        stats: Dictionary, receives the number of cards of the page ('cards')
+    Returns:
+        job_info_tab: Array of JobRecord, contains job information 
+    """
+    job_info_tab = []
+    adapter = get_site_adapter(website)
+    country = sys.intern(country)
+    country_code = sys.intern(get_country_code(country))
+    fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    # Retrieve title, company name, company location, salary, summary, date, id and url
+    cards = adapter.find_cards(soup)
+    if stats is not None:
+        stats['cards'] = len(cards)
+    for item in cards:
+        # Fields of the card are only parsed if its title is accepted
+        tags = adapter.extract_fields(item)
+        job_title = check_job_title(adapter.parse_title(item, tags), jobs_parameters)
+        if job_title != "":
+            card = adapter.parse_card(item, tags, url, fetched_at)
+
+            # Create record to retrieve data (repeated values are interned)
+            job = JobRecord(
+                Title=job_title,
+                Company=card['company'],
+                Country=country,
+                Country_code=country_code,
+                City=sys.intern(card['location']),
+                Salary=card['salary'],
+                Summary=card['summary'],
+                Posted_at=card['posted_at'],
+                Job_id=card['id'],
+                Job_url=card['url']
+            )
             
-            # Add job dictionary into jobs tab
+            # Add job record into jobs tab
             job_info_tab.append(job)
             
     return job_info_tab
 
 
+def defer_enrichment(job_tab):
+    """ Mark job records as waiting for company enrichment (done later by the web app)
+    Args:
+        job_tab: Array of JobRecord, contains job information
+    Returns:
+        job_tab: Array of JobRecord, contains job information
+    """
+    for job in job_tab:
+        job.Company_type = PENDING
+        job.Company_sector = PENDING
+    return job_tab
+
+
+def enrich_jobs(website, job_tab):
+    """ Add company type and sector to job records
+    Args:
+        website: String, website name
+        job_tab: Array of JobRecord, contains job information
+    Returns:
+        job_tab: Array of JobRecord, contains job information
+    """
+    for job in job_tab:
+        job.Company_type = sys.intern(get_job_company_type(website, job.Company))
+        job.Company_sector = get_job_company_sector(website, job.Company)
+    save_company_index()
+    return job_tab
+
+
+#######################################################
+# Near-duplicate detection
+#######################################################
+
+minhash_random = np.random.RandomState(0)
+MINHASH_PRIME = (1 << 31) - 1
+MINHASH_A = minhash_random.randint(1, MINHASH_PRIME, size=MINHASH_PERMUTATIONS).astype(np.int64)
+MINHASH_B = minhash_random.randint(0, MINHASH_PRIME, size=MINHASH_PERMUTATIONS).astype(np.int64)
+
+
+def normalize_text(text):
+    """ Normalize text into lowercase ascii words (accents and punctuation removed)
+    Args:
+        text: String, text (title, city or summary)
+    Returns:
+        text: String, words separated by spaces
+    """
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join([char for char in text if not unicodedata.combining(char)])
+    text = ' '.join(re.findall(r"[a-z0-9]+", text.lower().replace("'", "")))
+    return text
+
+
+def get_duplicate_key(job):
+    """ Get normalized (title, company, city) key of a job
+    Args:
+        job: JobRecord, job information
+    Returns:
+        key: Tuple of strings, normalized title, company and city
+    """
+    # Remove gender markers ('Data Scientist (H/F)', 'Data Engineer m/w/d')
+    title = re.sub(r"\(?\b[hfmwd](\s*/\s*[hfmwd])+\b\)?", " ", job.Title.lower())
+    key = (normalize_text(title), normalize_company_name(job.Company, remove_suffixes=True), normalize_text(job.City))
+    return key
+
+
+def get_minhash_signature(text):
+    """ Compute MinHash signature of a text (word 3-grams)
+    Args:
+        text: String, text
+    Returns:
+        signature: Array of integers, MinHash signature (None if the text is empty)
+    """
+    words = normalize_text(text).split()
+    if len(words) == 0:
+        return None
+    shingles = set([' '.join(words[i:i+3]) for i in range(max(len(words) - 2, 1))])
+    hashes = np.array([zlib.crc32(shingle.encode('utf-8')) % MINHASH_PRIME for shingle in shingles], dtype=np.int64)
+    signature = ((MINHASH_A[:, None] * hashes[None, :] + MINHASH_B[:, None]) % MINHASH_PRIME).min(axis=1)
+    return signature
+
+
+def get_title_similarity(title_a, title_b):
+    """ Jaccard similarity of the words of two normalized titles """
+    words_a, words_b = set(title_a.split()), set(title_b.split())
+    return len(words_a & words_b) / max(len(words_a | words_b), 1)
+
+
+class DuplicateDetector:
+    """ Near-duplicate jobs detector (same posting on several websites, or reposted with a new id)
+    A job is a duplicate of a previous one if they have the same normalized (title, company, city) key,
+    or the same company, similar titles and similar summaries. Similar summaries are found with LSH over
+    MinHash signatures (no pairwise comparison).
+    """
+
+    def __init__(self, threshold=DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.jobs_by_id = {}
+        self.jobs_by_key = {}
+        self.buckets = {}
+
+    def get_bands(self, signature):
+        rows = MINHASH_PERMUTATIONS // LSH_BANDS
+        bands = [(band, signature[band*rows:(band+1)*rows].tobytes()) for band in range(LSH_BANDS)]
+        return bands
+
+    def find(self, job, key, signature):
+        """ Find the job a new job is a duplicate of
+        Args:
+            job: JobRecord, new job
+            key: Tuple of strings, normalized (title, company, city) key of the new job
+            signature: Array of integers, MinHash signature of the new job summary
+        Returns:
+            canonical_job: JobRecord, job already found (None if the job is new)
+        """
+        if job.Job_id in self.jobs_by_id:
+            return self.jobs_by_id[job.Job_id]
+        if key in self.jobs_by_key:
+            return self.jobs_by_key[key]
+        if signature is not None:
+            for band in self.get_bands(signature):
+                for candidate, candidate_key, candidate_signature in self.buckets.get(band, []):
+                    if candidate_key[1] == key[1] and np.mean(candidate_signature == signature) >= self.threshold \
+                            and get_title_similarity(candidate_key[0], key[0]) >= DUPLICATE_TITLE_THRESHOLD:
+                        return candidate
+        return None
+
+    def register(self, job, key=None, signature=None):
+        """ Add new job to the detector """
+        key = key if key is not None else get_duplicate_key(job)
+        signature = signature if signature is not None else get_minhash_signature(job.Summary)
+        self.jobs_by_id[job.Job_id] = job
+        self.jobs_by_key.setdefault(key, job)
+        if signature is not None:
+            for band in self.get_bands(signature):
+                self.buckets.setdefault(band, []).append((job, key, signature))
+
+    def filter(self, job_tab):
+        """ Remove duplicates from jobs, the url of a duplicate is added to the sources of the first job found
+        Args:
+            job_tab: Array of JobRecord, new jobs
+        Returns:
+            unique_tab: Array of JobRecord, jobs found for the first time
+            duplicate_tab: Array of tuples, contains (canonical job, duplicate job)
+        """
+        unique_tab = []
+        duplicate_tab = []
+        for job in job_tab:
+            key = get_duplicate_key(job)
+            signature = get_minhash_signature(job.Summary)
+            canonical_job = self.find(job, key, signature)
+            if canonical_job is None:
+                self.register(job, key, signature)
+                unique_tab.append(job)
+            else:
+                merge_duplicate(canonical_job, job.Job_url)
+                duplicate_tab.append((canonical_job, job))
+        return unique_tab, duplicate_tab
+
+
+def merge_duplicate(canonical_job, job_url):
+    """ Add url of a duplicate to the sources of a job
+    Args:
+        canonical_job: JobRecord, job found first
+        job_url: String, url of the duplicate
+    Returns:
+        None
+    """
+    sources = canonical_job.Sources.split()
+    if job_url != "" and job_url != canonical_job.Job_url and job_url not in sources:
+        canonical_job.Sources = ' '.join(sources + [job_url])
+
+
+def transform_data(website, country, url, soup, jobs_parameters, fetched_at=None):
+    """ Create job records with job and company information
+    Args:
+        website: String, website name
+        country: String, country name
+        url: String, url
+        soup: Soup object, contains extracted data
+        jobs_parameters: Dictionay, contains information about user request
+        fetched_at: Float, timestamp of the page download (now if None)
+    Returns:
+        job_info_tab: Array of JobRecord, contains job information 
+    """
+    job_info_tab = parse_cards(website, country, url, soup, jobs_parameters, fetched_at=fetched_at)
+    job_info_tab = enrich_jobs(website, job_info_tab)
+    return job_info_tab
+
+
 def rate_title(title, title_keywords_ordered):
     """ Rate job title
     Args:
@@ -826,61 +1669,868 @@ def rate_jobs(df_jobs, jobs_parameters):
     return df_jobs
     
     
-def scrape_jobs(jobs_parameters):
-    """ Scrap jobs from several websites
+def create_jobs_df(job_tab, website):
+    """ Create dataframe with jobs information
     Args:
-        jobs_parameters: Dictionay, contains information about user request
+        job_tab: Array of JobRecord, contains job information
+        website: String, website name
+    Returns:
+        df: Dataframe, contains jobs information
+    """
+    df = pd.DataFrame.from_records([job.to_tuple() for job in job_tab], columns=JobRecord.__slots__)
+    df = df[['Title', 'Company', 'Company_type', 'Company_sector', 'Country', 'Country_code', 'City', 'Summary', 'Posted_at', 'Job_id', 'Job_url', 'Sources']]
+    df.insert(0, 'Website', sys.intern(website[0].upper() + website[1:]))
+    return df
+
+
+def compact_jobs_df(df_jobs):
+    """ Store low cardinality columns as categories
+    Args:
+        df_jobs: Dataframe, contains information about scrapped jobs
     Returns:
         df_jobs: Dataframe, contains information about scrapped jobs
     """
-    website_nb = 0
-    
-    # Loop on websites
+    for col in JOBS_CATEGORICAL_COLUMNS:
+        df_jobs[col] = df_jobs[col].astype('category')
+    return df_jobs
+
+
+def clean_jobs_df(df_jobs):
+    """ Remove duplicated jobs and punctuation at the end of fields
+    Args:
+        df_jobs: Dataframe, contains information about scrapped jobs
+    Returns:
+        df_jobs: Dataframe, contains information about scrapped jobs
+    """
+    df_jobs = df_jobs.drop_duplicates(subset=['Job_id'])
+    for col in list(df_jobs.columns):
+        df_jobs[col] = df_jobs[col].apply(remove_elements_end_sentence)
+    return df_jobs
+
+
+def create_grid(jobs_parameters):
+    """ Create grid of pages to scrap
+    Args:
+        jobs_parameters: Dictionay, contains information about user request
+    Returns:
+        grid: Array of tuples, contains (website, country, city, page)
+    """
+    grid = []
+    countries_dic = create_countries_dic(jobs_parameters['location'])
+
+    # Loop on websites, countries, cities and pages
     for website in jobs_parameters['website']:
-        job_tab = []
-        countries_dic = create_countries_dic(jobs_parameters['location'])
-        
-        # Loop on countries
         for country, cities in countries_dic.items():
-            
-            # Loop on cities
             if type(cities) is str:
                 cities = [cities]
             for city in cities:
-                
-                # Loop on pages
                 for page in range(0, jobs_parameters['pages']):
-                    
-                    # Extract whole data from 1 page
-                    url, soup = extract_data(website, country, city, page, jobs_parameters)
-                    print(url)
-#                     print(soup)
-
-                    # Create dictionary with job information
-                    job_dic = transform_data(website, country, url, soup, jobs_parameters)
-                    job_tab += job_dic
-
-                # Create df with jobs information
-                df = pd.DataFrame(data=job_tab, columns=['Title', 'Company', 'Company_type', 'Company_sector', 'Country', 'Country_code', 'City', 'Summary', 'Date', 'Job_id', 'Job_url'])
-                df.insert(0, 'Website', [website[0].upper() + website[1:] for i in range(len(df))])
-        
-        if website_nb == 0:
-            df_jobs = df
+                    grid.append((website, country, city, page))
+    return grid
+
+
+class PageBudget:
+    """ Adaptive pagination controller
+    Pages of a (website, country, city) are fetched in grid order until its results run out or its yield
+    collapses (less than PAGE_MIN_YIELD of the cards are new matching jobs). The pages saved this way are then
+    given, one by one, to the city of the same website and country with the best yield (up to PAGE_MAX_FACTOR
+    times its pages). The number of requests of a website and country (same host) never exceeds its grid size,
+    so the listing requests of a plan are an upper bound (see estimate_plan).
+    Attributes:
+        grid: Array of tuples, contains (website, country, city, page)
+        cap: Integer, maximum number of pages (grid size)
+        used: Integer, number of pages fetched (or restored from checkpoint)
+        site_cap: Dictionary, (website, country) -> maximum number of pages (grid size of the website and country)
+        site_used: Dictionary, (website, country) -> number of pages fetched
+    """
+
+    def __init__(self, grid, min_yield=PAGE_MIN_YIELD, max_factor=PAGE_MAX_FACTOR):
+        self.grid = grid
+        self.cap = len(grid)
+        self.min_yield = min_yield
+        self.used = 0
+        self.keys = list(dict.fromkeys([(website, country, city) for website, country, city, page in grid]))
+        self.max_pages = {key: 0 for key in self.keys}
+        self.site_cap = {key[:2]: 0 for key in self.keys}
+        for website, country, city, page in grid:
+            self.max_pages[(website, country, city)] += max_factor
+            self.site_cap[(website, country)] += 1
+        self.site_used = {site: 0 for site in self.site_cap}
+        self.next_page = {key: 0 for key in self.keys}
+        self.matches = {key: 0 for key in self.keys}
+        self.stopped = set()
+
+    def cells(self):
+        """ Generate pages to fetch (record() must be called for each page) """
+        for website, country, city, page in self.grid:
+            key = (website, country, city)
+            if key not in self.stopped and self.used < self.cap and self.site_used[key[:2]] < self.site_cap[key[:2]]:
+                yield (website, country, city, self.next_page[key])
+
+        # Saved pages go to the city with the best yield (same website and country)
+        while self.used < self.cap:
+            active = [key for key in self.keys if key not in self.stopped and self.site_used[key[:2]] < self.site_cap[key[:2]]]
+            if len(active) == 0:
+                break
+            key = max(active, key=self.get_yield)
+            yield key + (self.next_page[key],)
+
+    def record(self, cell, nb_cards, nb_matches):
+        """ Record result of a page (0 cards: results ran out or page not fetched) """
+        key = cell[:3]
+        self.used += 1
+        self.site_used[key[:2]] += 1
+        self.next_page[key] += 1
+        self.matches[key] += nb_matches
+        if nb_cards == 0 or nb_matches < max(self.min_yield*nb_cards, 1) or self.next_page[key] >= self.max_pages[key]:
+            self.stopped.add(key)
+
+    def get_yield(self, key):
+        return self.matches[key] / max(self.next_page[key], 1)
+
+    def get_remaining(self):
+        """ Number of pages which can still be fetched """
+        remaining = 0
+        for site in self.site_cap:
+            site_remaining = sum([self.max_pages[key] - self.next_page[key] for key in self.keys if key[:2] == site and key not in self.stopped])
+            remaining += min(self.site_cap[site] - self.site_used[site], site_remaining)
+        return min(self.cap - self.used, remaining)
+
+
+#######################################################
+# Request plan (cost estimation before a run)
+#######################################################
+
+HOST_STATS_JSON = "../../data/host_stats.json"
+HOST_STATS_ALPHA = 0.2 # weight of the last request in the moving averages
+# Estimates without history: listing and company requests (bytes, seconds), LinkedIn requests by company to resolve
+# and company requests by listing page (inline enrichment)
+HOST_STATS_DEFAULT = {'listing': {'bytes': 200*1024, 'seconds': 2.0}, 'company': {'bytes': 150*1024, 'seconds': 1.5}}
+COMPANY_REQUESTS_DEFAULT = 2
+PAGE_COMPANY_REQUESTS_DEFAULT = 10
+COMPANY_HOST = "www.linkedin.com"
+REVALIDATION_BYTES = 1024 # stale cached pages are revalidated (304 without body)
+PLAN_MAX_REQUESTS = 300 # network requests by host and run: larger searches are trimmed (fewer pages by city) or rejected
+host_stats = None
+network_requests = {'listing': 0, 'company': 0} # requests sent by this process
+
+
+def get_request_kind(url):
+    """ Get kind of a request: 'company' (LinkedIn company page) or 'listing' """
+    return 'company' if urlsplit(url).path.startswith('/company/') else 'listing'
+
+
+def load_host_stats(json_filename=HOST_STATS_JSON):
+    """ Load request statistics of the previous runs from json file
+    Args:
+        json_filename: String, json filename
+    Returns:
+        host_stats: Dictionary, contains moving averages by host and request kind ('hosts'), company requests
+        by listing page of each website ('sites') and requests by resolved company ('companies')
+    """
+    global host_stats
+    if host_stats is None:
+        try:
+            with open(json_filename, "r") as json_file:
+                host_stats = json.load(json_file)
+        except:
+            host_stats = {'hosts': {}, 'sites': {}, 'companies': {}}
+    return host_stats
+
+
+def save_host_stats(json_filename=HOST_STATS_JSON):
+    """ Save request statistics into json file
+    Args:
+        json_filename: String, json filename
+    Returns:
+        None
+    """
+    try:
+        os.makedirs(os.path.dirname(json_filename) or ".", exist_ok=True)
+        tmp_filename = "{}.tmp".format(json_filename)
+        with open(tmp_filename, "w") as json_file:
+            json.dump(load_host_stats(json_filename), json_file, indent=4, separators=(', ', ': '))
+        os.replace(tmp_filename, json_filename)
+    except:
+        print(">> Error while saving file '{}'".format(json_filename))
+
+
+def update_average(stats, name, value):
+    stats[name] = value if name not in stats else stats[name] + HOST_STATS_ALPHA*(value - stats[name])
+
+
+def record_request_stats(url, nb_bytes, seconds, full=True):
+    """ Record a network request (size and duration of the response by host and request kind)
+    Args:
+        url: String, url
+        nb_bytes: Integer, response body size
+        seconds: Float, request duration
+        full: Boolean, 200 response with the page (304, errors and block pages are counted, not averaged)
+    Returns:
+        None
+    """
+    kind = get_request_kind(url)
+    network_requests[kind] += 1
+    if not full:
+        return
+    stats = load_host_stats()['hosts'].setdefault(urlsplit(url).hostname, {}).setdefault(kind, {'requests': 0})
+    stats['requests'] += 1
+    update_average(stats, 'bytes', nb_bytes)
+    update_average(stats, 'seconds', seconds)
+
+
+def record_company_stats(nb_requests):
+    """ Record network requests sent to resolve a company """
+    stats = load_host_stats()['companies']
+    stats['resolutions'] = stats.get('resolutions', 0) + 1
+    update_average(stats, 'requests', nb_requests)
+
+
+def record_page_stats(website, nb_company_requests):
+    """ Record company requests sent for the jobs of a listing page (inline enrichment) """
+    stats = load_host_stats()['sites'].setdefault(website, {'pages': 0})
+    stats['pages'] += 1
+    update_average(stats, 'company_requests', nb_company_requests)
+
+
+def get_request_estimate(host, kind):
+    """ Get average size and duration of a request, from the host history (or another host of the same site)
+    Args:
+        host: String, host name
+        kind: String, request kind ('listing' or 'company')
+    Returns:
+        estimate: Dictionary, contains bytes and seconds
+    """
+    hosts = load_host_stats()['hosts']
+    if kind in hosts.get(host, {}):
+        return hosts[host][kind]
+    domain = '.'.join(host.split('.')[-2:]) # fr.indeed.com -> indeed.com
+    similar = [stats[kind] for name, stats in hosts.items() if name.endswith(domain) and kind in stats]
+    if len(similar) > 0:
+        return {'bytes': np.mean([stats['bytes'] for stats in similar]), 'seconds': np.mean([stats['seconds'] for stats in similar])}
+    return HOST_STATS_DEFAULT[kind]
+
+
+def get_page_companies(website, country, url, entry, jobs_parameters):
+    """ Get companies to resolve for the jobs of a cached listing page
+    Args:
+        website: String, website name
+        country: String, country name
+        url: String, url
+        entry: Dictionary, cache entry of the page (see read_cache)
+        jobs_parameters: Dictionay, contains information about user request
+    Returns:
+        company_tab: Array of strings, normalized names of the companies missing in the company index (None if the page is unreadable)
+    """
+    try:
+        with open(get_body_filename(entry['body']), 'rb') as f:
+            soup = BeautifulSoup(zlib.decompress(f.read()), 'html.parser')
+        job_tab = parse_cards(website, country, url, soup, jobs_parameters, fetched_at=entry.get('content_at', entry['fetched_at']))
+    except Exception:
+        return None
+    posted_after = jobs_parameters.get('posted_after')
+    if posted_after is not None:
+        job_tab = [job for job in job_tab if job.Posted_at >= posted_after - POSTED_AT_MARGIN]
+
+    index = load_company_index()
+    company_tab = []
+    for job in job_tab:
+        key = normalize_company_name(job.Company)
+        company = index.get(key)
+        if company is not None and time.time() - company['timestamp'] < (COMPANY_INDEX_TTL_HIT if company['slug'] is not None else COMPANY_INDEX_TTL_MISS):
+            continue
+        company_tab.append(key)
+    return company_tab
+
+
+def create_plan(jobs_parameters, plan=None):
+    """ Expand jobs parameters into listing requests, checked against the HTTP cache and the pages already fetched by the batch (without any request to the job boards).
+    Companies of the cached pages are checked against the company index, the others are estimated from previous runs
+    Args:
+        jobs_parameters: Dictionay, contains information about user request
+        plan: Dictionary, plan of the previous searches of a batch (pages shared by searches are requested once)
+    Returns:
+        plan: Dictionary, url -> {'website', 'host', 'page', 'cache' ('fresh', 'stale' or 'miss'), 'enrich', 'companies'}
+    """
+    plan = {} if plan is None else plan
+    enrich = jobs_parameters.get('enrichment', 'inline') != 'deferred'
+    for website, country, city, page in create_grid(jobs_parameters):
+        url = get_site_adapter(website).create_url(country, city, page, jobs_parameters)
+        if url in plan:
+            plan[url]['enrich'] = plan[url]['enrich'] or enrich
+            continue
+        status, entry = get_cache_status(url, {})
+        if listing_memo is not None and url in listing_memo:
+            status = 'fresh' # fetched by a previous search of the batch (see run_batch)
+        companies = get_page_companies(website, country, url, entry, jobs_parameters) if status == 'fresh' else None
+        plan[url] = {'website': website, 'host': urlsplit(url).hostname, 'page': page, 'cache': status, 'enrich': enrich, 'companies': companies}
+    return plan
+
+
+def estimate_plan(plan, pages=None):
+    """ Estimate network requests, bytes and wall time of a plan by host (listing requests are an upper bound:
+    adaptive pagination never fetches more pages of a website and country than its grid, see PageBudget)
+    Args:
+        plan: Dictionary, see create_plan
+        pages: Integer, only count the first pages of each city (all pages if None)
+    Returns:
+        estimate: Dictionary, host -> {'requests', 'cached', 'bytes', 'seconds'}
+    """
+    stats = load_host_stats()
+    estimate = {}
+    companies = set()
+    nb_company_requests = 0
+    for url, request in plan.items():
+        if pages is not None and request['page'] >= pages:
+            continue
+        host_estimate = estimate.setdefault(request['host'], {'requests': 0, 'cached': 0, 'bytes': 0, 'seconds': 0})
+        if request['cache'] == 'fresh':
+            host_estimate['cached'] += 1
         else:
-            df_jobs = pd.concat([df_jobs, df])
-        website_nb += 1
-        
-    df_jobs = df_jobs.drop_duplicates(subset=['Job_id'])
-    for col in list(df_jobs.columns):
-        df_jobs[col] = df_jobs[col].apply(remove_elements_end_sentence)
+            request_estimate = get_request_estimate(request['host'], 'listing')
+            host_estimate['requests'] += 1
+            host_estimate['bytes'] += REVALIDATION_BYTES if request['cache'] == 'stale' else request_estimate['bytes']
+            host_estimate['seconds'] += request_estimate['seconds']
+
+        # Companies are resolved once by run (and batch)
+        if request['enrich']:
+            if request['companies'] is not None:
+                companies.update(request['companies'])
+            else:
+                nb_company_requests += stats['sites'].get(request['website'], {}).get('company_requests', PAGE_COMPANY_REQUESTS_DEFAULT)
+    nb_company_requests += len(companies) * stats['companies'].get('requests', COMPANY_REQUESTS_DEFAULT)
+
+    if nb_company_requests > 0:
+        request_estimate = get_request_estimate(COMPANY_HOST, 'company')
+        host_estimate = estimate.setdefault(COMPANY_HOST, {'requests': 0, 'cached': 0, 'bytes': 0, 'seconds': 0})
+        host_estimate['requests'] += int(np.ceil(nb_company_requests))
+        host_estimate['bytes'] += nb_company_requests * request_estimate['bytes']
+        host_estimate['seconds'] += nb_company_requests * request_estimate['seconds']
+    for host_estimate in estimate.values():
+        host_estimate['bytes'] = int(host_estimate['bytes'])
+        host_estimate['seconds'] = round(host_estimate['seconds'], 1)
+    return estimate
+
+
+def check_estimate(estimate, max_requests=PLAN_MAX_REQUESTS, max_seconds=RUN_DEADLINE):
+    """ Check estimate against the run limits
+    Args:
+        estimate: Dictionary, see estimate_plan
+        max_requests: Integer, maximum network requests by host
+        max_seconds: Float, maximum wall time of the requests (None: no limit)
+    Returns:
+        error: String, exceeded limit (None if the plan fits)
+    """
+    for host, host_estimate in estimate.items():
+        if host_estimate['requests'] > max_requests:
+            return "{} requests to '{}' (limit: {})".format(host_estimate['requests'], host, max_requests)
+    seconds = sum([host_estimate['seconds'] for host_estimate in estimate.values()])
+    if max_seconds is not None and seconds > max_seconds:
+        return "{:.0f} seconds of requests (run deadline: {:.0f})".format(seconds, max_seconds)
+    return None
+
+
+def fit_plan(jobs_parameters, max_requests=PLAN_MAX_REQUESTS, max_seconds=RUN_DEADLINE):
+    """ Find the largest number of pages by city whose plan fits into the run limits (oversized searches are trimmed)
+    Args:
+        jobs_parameters: Dictionay, contains information about user request
+        max_requests: Integer, maximum network requests by host
+        max_seconds: Float, maximum wall time of the requests (None: no limit)
+    Returns:
+        pages: Integer, number of pages by city (jobs_parameters['pages'] if the search is not trimmed)
+        estimate: Dictionary, estimate of the plan with these pages (see estimate_plan)
+    Raises:
+        ValueError: the search does not fit even with 1 page by city
+    """
+    if jobs_parameters['pages'] == 0:
+        return 0, {}
+    plan = create_plan(jobs_parameters)
+    for pages in range(jobs_parameters['pages'], 0, -1):
+        estimate = estimate_plan(plan, pages)
+        error = check_estimate(estimate, max_requests, max_seconds)
+        if error is None:
+            return pages, estimate
+    raise ValueError("search rejected, {} with 1 page by city".format(error))
+
+
+def print_estimate(estimate):
+    """ Print estimate of a plan (one line by host) """
+    print("{:<24} {:>9} {:>8} {:>10} {:>10}".format("HOST", "REQUESTS", "CACHED", "MB", "SECONDS"))
+    for host, host_estimate in sorted(estimate.items()):
+        print("{:<24} {:>9} {:>8} {:>10.1f} {:>10.1f}".format(host, host_estimate['requests'], host_estimate['cached'], host_estimate['bytes']/2**20, host_estimate['seconds']))
+    print("{:<24} {:>9} {:>8} {:>10.1f} {:>10.1f}".format("TOTAL", sum([e['requests'] for e in estimate.values()]), sum([e['cached'] for e in estimate.values()]),
+                                                     sum([e['bytes'] for e in estimate.values()])/2**20, sum([e['seconds'] for e in estimate.values()])))
+
+
+def plan_searches(json_filenames, max_requests=PLAN_MAX_REQUESTS, max_seconds=RUN_DEADLINE, stream=False):
+    """ Print the request plan of searches without scraping them (dry run), pages shared by searches are counted once
+    Args:
+        json_filenames: Array of strings, json jobs parameters filenames
+        max_requests: Integer, maximum network requests by host and search
+        max_seconds: Float, maximum wall time of the requests by search
+        stream: Boolean, also write a 'plan' event by search into stdout (read by the web app)
+    Returns:
+        estimate: Dictionary, estimate of the searches (see estimate_plan)
+    """
+    plan = {}
+    for json_filename in json_filenames:
+        jobs_parameters = read_jobs_parameters(json_filename)
+        try:
+            pages, estimate = fit_plan(jobs_parameters, max_requests, max_seconds)
+        except ValueError as e:
+            print(">> '{}': {}".format(json_filename, e))
+            if stream:
+                emit_event('plan', parameters=json_filename, requested_pages=jobs_parameters['pages'], error=str(e))
+            continue
+        if pages < jobs_parameters['pages']:
+            print(">> '{}': trimmed to {} pages by city ({} requested)".format(json_filename, pages, jobs_parameters['pages']))
+        if stream:
+            emit_event('plan', parameters=json_filename, requested_pages=jobs_parameters['pages'], pages=pages, hosts=estimate)
+        create_plan(dict(jobs_parameters, pages=pages), plan)
+
+    estimate = estimate_plan(plan)
+    print_estimate(estimate)
+    return estimate
+
+
+#######################################################
+# Checkpoints (resume long runs)
+#######################################################
+
+CHECKPOINT_DIR = "../../data/checkpoints"
+
+
+def serialize_jobs_parameters(jobs_parameters):
+    """ Convert jobs parameters into json serializable dictionary
+    Args:
+        jobs_parameters: Dictionay, contains information about user request
+    Returns:
+        parameters: Dictionary, contains information about user request (sets are sorted lists)
+    """
+    parameters = {key: sorted(value) if isinstance(value, set) else value for key, value in jobs_parameters.items()}
+    return parameters
+
+
+def get_checkpoint_filename(jobs_parameters, checkpoint_dir=CHECKPOINT_DIR):
+    """ Get checkpoint filename of a user request (same request -> same checkpoint)
+    Args:
+        jobs_parameters: Dictionay, contains information about user request
+        checkpoint_dir: String, checkpoints directory
+    Returns:
+        checkpoint_filename: String, checkpoint filename
+    """
+    parameters = json.dumps(serialize_jobs_parameters(jobs_parameters), sort_keys=True)
+    key = hashlib.sha1(parameters.encode('utf-8')).hexdigest()[:16]
+    checkpoint_filename = os.path.join(checkpoint_dir, "{}.jsonl".format(key))
+    return checkpoint_filename
+
+
+def load_checkpoint(checkpoint_filename):
+    """ Load pages already scrapped, the line written during a crash (if any) is removed from the file
+    so that the pages of the resumed run are appended after the last complete page
+    Args:
+        checkpoint_filename: String, checkpoint filename
+    Returns:
+        done_cells: Dictionary, {(website, country, city, page): (array of job dictionaries, array of [job id, duplicate url], number of cards)}
+    """
+    done_cells = {}
+    if not os.path.isfile(checkpoint_filename):
+        return done_cells
+    valid_size = 0 # bytes of the complete lines
+    with open(checkpoint_filename, "rb") as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("partial line")
+                checkpoint = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break # last line written during a crash
+            done_cells[tuple(checkpoint['cell'])] = (checkpoint['jobs'], checkpoint.get('duplicates', []), checkpoint.get('cards', len(checkpoint['jobs'])))
+            valid_size += len(line)
+    if valid_size < os.path.getsize(checkpoint_filename):
+        with open(checkpoint_filename, "r+b") as checkpoint_file:
+            checkpoint_file.truncate(valid_size)
+        print(">> Partial page removed from '{}'".format(checkpoint_filename))
+    print(">> {} pages restored from '{}'".format(len(done_cells), checkpoint_filename))
+    return done_cells
+
+
+def write_checkpoint(checkpoint_file, cell, job_tab, duplicate_tab=None, cards=None):
+    """ Append scrapped (and enriched) page into checkpoint file
+    Args:
+        checkpoint_file: File, checkpoint file opened in append mode
+        cell: Tuple, contains (website, country, city, page)
+        job_tab: Array of JobRecord, contains job information
+        duplicate_tab: Array of tuples, contains (canonical job, duplicate job), None if no duplicates
+        cards: Integer, number of cards of the page, replayed into the page budget on resume (number of jobs if None)
+    Returns:
+        None
+    """
+    duplicates = [[canonical_job.Job_id, job.Job_url] for canonical_job, job in duplicate_tab or []]
+    cards = len(job_tab) if cards is None else cards
+    checkpoint_file.write(json.dumps({'cell': list(cell), 'jobs': [job.to_dict() for job in job_tab], 'duplicates': duplicates, 'cards': cards}) + "\n")
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
+
+
+#######################################################
+# Scraping
+#######################################################
+
+def scrape_jobs(jobs_parameters, on_page=None, checkpoint_filename=None, resume=False):
+    """ Scrap jobs from several websites
+    Args:
+        jobs_parameters: Dictionay, contains information about user request
+        on_page: Function, called after each page with (df_page, pages_done, pages_total, duplicate_tab), df_page contains new rated jobs
+        checkpoint_filename: String, file where every scrapped page is saved (no checkpoint if None)
+        resume: Boolean, skip pages already saved in the checkpoint file
+    Returns:
+        df_jobs: Dataframe, contains information about scrapped jobs
+    """
+    with profiler.stage('grid'):
+        grid = create_grid(jobs_parameters)
+    budget = PageBudget(grid)
+    page_tab = []
+    detector = DuplicateDetector()
+    skipped_pages = 0
+    posted_after = jobs_parameters.get('posted_after')
+
+    done_cells = {}
+    checkpoint_file = None
+    if checkpoint_filename is not None:
+        if resume:
+            done_cells = load_checkpoint(checkpoint_filename)
+        os.makedirs(os.path.dirname(checkpoint_filename) or ".", exist_ok=True)
+        checkpoint_file = open(checkpoint_filename, "a" if resume else "w", encoding='utf-8')
+    
+    # Pages are chosen by the budget controller as results arrive (new matching jobs by page)
+    for cell in budget.cells():
+        website, country, city, page = cell
+        if cell in done_cells:
+            jobs, duplicates, cards = done_cells[cell]
+            job_dic = [JobRecord(**job) for job in jobs]
+            for job in job_dic:
+                detector.register(job)
+            duplicate_tab = [(detector.jobs_by_id[job_id], JobRecord(Job_url=job_url)) for job_id, job_url in duplicates if job_id in detector.jobs_by_id]
+            for canonical_job, job in duplicate_tab:
+                merge_duplicate(canonical_job, job.Job_url)
+            budget.record(cell, cards, len(job_dic))
+        else:
+            # Extract whole data from 1 page (skipped if the site is unavailable or the run deadline exceeded)
+            try:
+                url, soup, fetched_at = extract_data(website, country, city, page, jobs_parameters)
+            except (FetchError, requests.RequestException) as e:
+                print(">> Page skipped {}: {}".format(cell, e))
+                skipped_pages += 1
+                budget.record(cell, 0, 0)
+                if on_page is not None:
+                    on_page(create_jobs_df([], website), budget.used, budget.used + budget.get_remaining(), [])
+                continue
+            print(url)
+
+            # Create dictionary with job information, duplicates are removed before company enrichment
+            stats = {}
+            with profiler.stage('cards'):
+                job_dic = parse_cards(website, country, url, soup, jobs_parameters, fetched_at=fetched_at, stats=stats)
+
+            # Delta run: postings of the previous run are not enriched again (pages are sorted by date, their yield drops to 0)
+            if posted_after is not None:
+                job_dic = [job for job in job_dic if job.Posted_at >= posted_after - POSTED_AT_MARGIN]
+            with profiler.stage('dedupe'):
+                job_dic, duplicate_tab = detector.filter(job_dic)
+            budget.record(cell, stats['cards'], len(job_dic))
+            with profiler.stage('enrich'):
+                if jobs_parameters.get('enrichment') == 'deferred':
+                    job_dic = defer_enrichment(job_dic)
+                else:
+                    nb_requests = network_requests['company']
+                    job_dic = enrich_jobs(website, job_dic)
+                    record_page_stats(website, network_requests['company'] - nb_requests)
+            if checkpoint_file is not None:
+                with profiler.stage('checkpoint'):
+                    write_checkpoint(checkpoint_file, cell, job_dic, duplicate_tab, cards=stats['cards'])
+        page_tab.append((website, job_dic))
+
+        # Send new jobs of the page (already rated)
+        if on_page is not None:
+            with profiler.stage('rate'):
+                df_page = rate_jobs(clean_jobs_df(create_jobs_df(job_dic, website)), jobs_parameters)
+            on_page(df_page, budget.used, budget.used + budget.get_remaining(), duplicate_tab)
+
+    if checkpoint_file is not None:
+        checkpoint_file.close()
+    save_host_stats()
+
+    # Dataframes are created at the end (sources of the jobs are updated by their duplicates)
+    with profiler.stage('dataframe'):
+        df_tab = [create_jobs_df(job_dic, website) for website, job_dic in page_tab]
+        if len(df_tab) > 0:
+            df_jobs = pd.concat(df_tab)
+        else:
+            df_jobs = create_jobs_df([], "-")
         
     # Rate jobs
+    with profiler.stage('rate'):
+        df_jobs = rate_and_sort_jobs(df_jobs, jobs_parameters)
+    df_jobs.attrs['skipped_pages'] = skipped_pages
+    return df_jobs
+
+
+def rate_and_sort_jobs(df_jobs, jobs_parameters):
+    """ Clean, rate and sort jobs
+    Args:
+        df_jobs: Dataframe, contains information about scrapped jobs
+        jobs_parameters: Dictionay, contains information about user request
+    Returns:
+        df_jobs: Dataframe, contains information about scrapped jobs
+    """
+    df_jobs = clean_jobs_df(df_jobs)
     df_jobs = rate_jobs(df_jobs, jobs_parameters)
     df_jobs = df_jobs.sort_values(by='General rating', ascending=False).reset_index(drop=False)
+    df_jobs = compact_jobs_df(df_jobs)
+    return df_jobs
+
+
+#######################################################
+# Batch of searches
+#######################################################
+
+def save_jobs(df_jobs, filename_csv):
+    """ Save jobs as csv and json files
+    Args:
+        df_jobs: Dataframe, contains information about scrapped jobs
+        filename_csv: String, csv filename (json filename is the same with .json extension)
+    Returns:
+        None
+    """
+    save_df2csv(df_jobs, filename_csv)
+    convert_csv2json(filename_csv, os.path.splitext(filename_csv)[0] + ".json")
+
+
+def get_batch_output_names(json_filenames):
+    """ Get output names of the searches of a batch: parameters file name, or its path from the
+    common directory when several parameters files have the same name (a/x.json, b/x.json -> a_x, b_x)
+    Args:
+        json_filenames: Array of strings, json jobs parameters filenames
+    Returns:
+        name_tab: Array of strings, output names (without extension)
+    """
+    basename_tab = [os.path.splitext(os.path.basename(json_filename))[0] for json_filename in json_filenames]
+    if len(set(basename_tab)) == len(basename_tab):
+        return basename_tab
+    abspath_tab = [os.path.abspath(json_filename) for json_filename in json_filenames]
+    common_dir = os.path.commonpath([os.path.dirname(abspath) for abspath in abspath_tab])
+    name_tab = []
+    for basename, abspath in zip(basename_tab, abspath_tab):
+        if basename_tab.count(basename) > 1:
+            basename = os.path.splitext(os.path.relpath(abspath, common_dir))[0].replace(os.sep, "_")
+        name_tab.append(basename)
+    return name_tab
+
+
+def run_batch(json_filenames, output_dir, deadline=RUN_DEADLINE, archive=True, max_requests=PLAN_MAX_REQUESTS, resume=False):
+    """ Scrap several searches in one process, geo data, company profiles and listing pages are shared:
+    requests of the batch only depend on its distinct cities, pages and companies
+    Args:
+        json_filenames: Array of strings, json jobs parameters filenames
+        output_dir: String, directory of the jobs files (one csv and json by search, named as its parameters file, see get_batch_output_names)
+        deadline: Float, seconds by search before skipping its pages
+        archive: Boolean, append jobs of each search to the archive
+        max_requests: Integer, maximum network requests by host and search (see fit_plan)
+        resume: Boolean, skip pages saved by the last interrupted run of each search
+    Returns:
+        filename_tab: Array of strings, csv filenames of the searches (rejected searches excluded)
+    """
+    global listing_memo
+    listing_memo = {}
+    os.makedirs(output_dir, exist_ok=True)
+    filename_tab = []
+    nb_pages = 0
+    for json_filename, output_name in zip(json_filenames, get_batch_output_names(json_filenames)):
+        jobs_parameters = read_jobs_parameters(json_filename)
+        print("\nJobs parameters '{}'".format(json_filename), jobs_parameters, "\n")
+        checkpoint_filename = get_checkpoint_filename(jobs_parameters) # requested pages (the fitted pages change with the cache)
+        try:
+            jobs_parameters['pages'], _ = fit_plan(jobs_parameters, max_requests, deadline)
+        except ValueError as e:
+            print(">> '{}': {}".format(json_filename, e))
+            if os.path.isfile(checkpoint_filename):
+                os.remove(checkpoint_filename) # rejected search: nothing to resume
+            continue
+        set_run_deadline(deadline)
+        df_jobs = scrape_jobs(jobs_parameters, checkpoint_filename=checkpoint_filename, resume=resume)
+        nb_pages += len(create_grid(jobs_parameters))
+
+        filename_csv = os.path.join(output_dir, output_name + ".csv")
+        save_jobs(df_jobs, filename_csv)
+        filename_tab.append(filename_csv)
+        if archive:
+            from archive import archive_run # pyarrow is only required to archive
+            archive_run(df_jobs)
+        if df_jobs.attrs.get('skipped_pages', 0) == 0:
+            os.remove(checkpoint_filename)
+
+    print(">> {} searches: {} pages, {} distinct pages fetched, {} companies in index".format(len(json_filenames), nb_pages, len(listing_memo), len(load_company_index())))
+    listing_memo = None
+    return filename_tab
+
+
+#######################################################
+# Distributed scraping (task queue)
+#######################################################
+
+def enqueue_jobs_run(queue, jobs_parameters, deadline=RUN_DEADLINE):
+    """ Create run with one task by page to scrap
+    Args:
+        queue: TaskQueue, task queue
+        jobs_parameters: Dictionay, contains information about user request
+        deadline: Float, seconds from now before skipping the pages of the run (None: no deadline)
+    Returns:
+        run: String, run id
+    """
+    run = queue.create_run(serialize_jobs_parameters(jobs_parameters))
+    # Deadline timestamp and delta filter are applied by the workers (see execute_task)
+    deadline_at = time.time() + deadline if deadline is not None else None
+    for website, country, city, page in create_grid(jobs_parameters):
+        queue.enqueue(run, 'page', {'website': website, 'country': country, 'city': city, 'page': page,
+                                    'posted_after': jobs_parameters.get('posted_after'), 'deadline': deadline_at})
+    return run
+
 
+def execute_task(queue, task):
+    """ Execute task ('page': scrap a page and enqueue its companies, 'company': resolve a company)
+    Args:
+        queue: TaskQueue, task queue
+        task: Dictionary, contains id, run, kind and payload
+    Returns:
+        result: Dictionary, task result
+    """
+    global run_deadline
+    payload = task['payload']
+    run_deadline = payload.get('deadline') # deadline of the enqueued run (same timestamp for every worker)
+    if task['kind'] == 'page':
+        jobs_parameters = queue.get_run_parameters(task['run'])
+        url, soup, fetched_at = extract_data(payload['website'], payload['country'], payload['city'], payload['page'], jobs_parameters)
+        print(url)
+        job_tab = parse_cards(payload['website'], payload['country'], url, soup, jobs_parameters, fetched_at=fetched_at)
+
+        # Delta run: postings of the previous run are not emitted again (same filter as scrape_jobs)
+        posted_after = payload.get('posted_after')
+        if posted_after is not None:
+            job_tab = [job for job in job_tab if job.Posted_at >= posted_after - POSTED_AT_MARGIN]
+
+        # Company enrichment is a task by company (shared by all pages of the run)
+        if jobs_parameters.get('enrichment') != 'deferred':
+            for company in set([job.Company for job in job_tab]):
+                queue.enqueue(task['run'], 'company', {'company': company, 'deadline': payload.get('deadline')})
+        result = {'website': payload['website'], 'jobs': [job.to_dict() for job in job_tab]}
+
+    elif task['kind'] == 'company':
+        company = resolve_company(payload['company'])
+        save_company_index()
+        result = {'type': company['type'], 'sector': company['sector']}
+
+    else:
+        raise ValueError("Unknown task kind '{}'".format(task['kind']))
+    return result
+
+
+def run_worker(queue, poll=1.0, kinds=None):
+    """ Lease and execute tasks until the queue is empty
+    Args:
+        queue: TaskQueue, task queue
+        poll: Float, seconds between two leases when tasks are leased by other workers
+        kinds: Array of strings, task kinds to execute (all kinds if None)
+    Returns:
+        nb_tasks: Integer, number of executed tasks
+    """
+    nb_tasks = 0
+    while True:
+        task = queue.lease(kinds=kinds)
+        if task is None:
+            # Leased tasks of dead workers come back after their visibility timeout
+            if queue.is_finished():
+                break
+            time.sleep(poll)
+            continue
+
+        try:
+            result = execute_task(queue, task)
+            queue.complete(task['id'], result)
+            nb_tasks += 1
+        except Exception as e:
+            print(">> Task {} ({}) failed: {}".format(task['id'], task['kind'], e))
+            queue.fail(task['id'], e)
+    return nb_tasks
+
+
+def merge_jobs_run(queue, run, poll=1.0):
+    """ Wait for the end of a run, then merge, deduplicate and rate its jobs
+    Args:
+        queue: TaskQueue, task queue
+        run: String, run id
+        poll: Float, seconds between two checks of the run
+    Returns:
+        df_jobs: Dataframe, contains information about scrapped jobs
+    """
+    while not queue.is_finished(run):
+        time.sleep(poll)
+    print(">> Run '{}' finished: {}".format(run, queue.stats(run)))
+
+    jobs_parameters = queue.get_run_parameters(run)
+    companies = {payload['company']: result for payload, result in queue.results(run, 'company')}
+    missing = PENDING if jobs_parameters.get('enrichment') == 'deferred' else "Unknown"
+    detector = DuplicateDetector()
+    page_tab = []
+    for payload, result in queue.results(run, 'page'):
+        job_tab, _ = detector.filter([JobRecord(**job) for job in result['jobs']])
+        page_tab.append((result['website'], job_tab))
+
+    df_tab = []
+    for website, job_tab in page_tab:
+        for job in job_tab:
+            company = companies.get(job.Company, {'type': missing, 'sector': missing})
+            job.Company_type = sys.intern(company['type'])
+            job.Company_sector = company['sector']
+        df_tab.append(create_jobs_df(job_tab, website))
+
+    if len(df_tab) > 0:
+        df_jobs = pd.concat(df_tab)
+    else:
+        df_jobs = create_jobs_df([], "-")
+    df_jobs = rate_and_sort_jobs(df_jobs, jobs_parameters)
     return df_jobs
 
 
+def emit_event(event, **data):
+    """ Write event into stdout (read line by line by the web app)
+    Args:
+        event: String, event name
+        data: Dictionary, event data
+    Returns:
+        None
+    """
+    data['event'] = event
+    print("{}{}".format(EVENT_PREFIX, json.dumps(data)), flush=True)
+
+
+def emit_page(df_page, pages_done, pages_total, duplicate_tab=None):
+    """ Stream jobs of a scrapped page
+    Args:
+        df_page: Dataframe, contains new rated jobs
+        pages_done: Integer, number of scrapped pages
+        pages_total: Integer, number of pages to scrap
+        duplicate_tab: Array of tuples, contains (canonical job, duplicate job), None if no duplicates
+    Returns:
+        None
+    """
+    emit_event('jobs', jobs=json.loads(df_page.to_json(orient='records')))
+    if duplicate_tab:
+        canonical_tab = {canonical_job.Job_id: canonical_job for canonical_job, job in duplicate_tab}
+        emit_event('sources', jobs=[{'Job_id': job_id, 'Sources': job.Sources} for job_id, job in canonical_tab.items()])
+    emit_event('progress', done=pages_done, total=pages_total)
+
+
 def check_jobs_parameters(jobs_parameters):
     """ Check jobs parameters values
     Args:
@@ -896,6 +2546,17 @@ def check_jobs_parameters(jobs_parameters):
     return website, distance, pages
 
 
+def stop_profiling(report_dir):
+    """ Stop profiling and write its report (registered at exit by --profile)
+    Args:
+        report_dir: String, directory of the report
+    Returns:
+        None
+    """
+    profiler.stop()
+    profiler.write_report(report_dir)
+
+
 def read_jobs_parameters(json_jobs_parameters):
     """ Read json jobs_parameters
     Args:
@@ -920,34 +2581,111 @@ def read_jobs_parameters(json_jobs_parameters):
         'pages': pages,    
         'title_keywords_ordered': set(data['title_keywords_ordered']),
         'company_size_type': data['company_size_type'],
+        'enrichment': data.get('enrichment', 'inline'),
+        'posted_after': data.get('posted_after'),
     }
     return jobs_parameters
 
 
 
 if __name__ == "__main__":
-    # Clean and create processed geoId csv file
-    geoId_csv = "../../data/raw/geoId.csv"
-    geoId_csv_processed = geoId_csv.replace('raw', 'processed')
-
-    if not os.path.isfile(geoId_csv_processed):
-        df_geoId = clean_data_geoId(geoId_csv)
-        print("File '{}' created".format(geoId_csv_processed))
-    else:
-        print("File '{}' already exists".format(geoId_csv_processed))
-        df_geoId = read_data(geoId_csv_processed)
+    parser = argparse.ArgumentParser(description="Scrap jobs from the user request")
+    parser.add_argument('--stream', action='store_true', help="write jobs and progress events into stdout as pages complete")
+    parser.add_argument('--enrich', nargs='+', metavar='COMPANY', help="write type and sector of companies into stdout (deferred enrichment)")
+    parser.add_argument('--resume', action='store_true', help="skip pages saved by the last interrupted run of the same request")
+    parser.add_argument('--queue', help="SQLite task queue shared by workers (ex: ../../data/queue.sqlite)")
+    parser.add_argument('--enqueue', action='store_true', help="split the user request into queue tasks and print the run id")
+    parser.add_argument('--worker', action='store_true', help="execute queue tasks until the queue is empty")
+    parser.add_argument('--coordinate', metavar='RUN', help="wait for the run, merge and save its jobs")
+    parser.add_argument('--batch', nargs='+', metavar='PARAMETERS_JSON', help="scrap several searches (json jobs parameters files) sharing geo data, companies and pages")
+    parser.add_argument('--output-dir', default="../../data/batch", help="directory of the batch jobs files (default: %(default)s)")
+    parser.add_argument('--profile', nargs='?', const=PROFILE_DIR, metavar='DIR', help="write CPU, memory and collapsed stacks reports by stage into DIR/<date> (default: %(const)s)")
+    parser.add_argument('--parameters', default="../../data/jobs_parameters_user_request.json", metavar='PARAMETERS_JSON', help="json jobs parameters file (default: %(default)s)")
+    parser.add_argument('--output', default="../../data/jobs.csv", metavar='CSV', help="csv jobs file, the json jobs file is written next to it (default: %(default)s)")
+    parser.add_argument('--no-archive', action='store_true', help="do not append jobs of the run to the archive (data/archive)")
+    parser.add_argument('--dry-run', action='store_true', help="print the requests, bytes and wall time the search would need by host (without scraping)")
+    parser.add_argument('--max-requests', type=int, default=PLAN_MAX_REQUESTS, metavar='N', help="trim (fewer pages by city) or reject searches needing more requests to a host (default: %(default)s)")
+    parser.add_argument('--deadline', type=float, default=RUN_DEADLINE, metavar='SECONDS', help="skip pages not fetched after this duration (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        profiler.start()
+        atexit.register(stop_profiling, os.path.join(args.profile, time.strftime("%Y%m%d-%H%M%S")))
+
+    if args.enrich is not None:
+        set_run_deadline(args.deadline)
+        for company_name in args.enrich:
+            company = resolve_company(company_name)
+            emit_event('company', company=company_name, type=company['type'], sector=company['sector'])
+        save_company_index()
+        save_host_stats()
+        sys.exit(0)
+
+    if args.queue is not None:
+        queue = TaskQueue(args.queue)
+        if args.worker:
+            print(">> {} tasks executed".format(run_worker(queue)))
+            sys.exit(0)
+        if args.coordinate is not None:
+            df_jobs = merge_jobs_run(queue, args.coordinate)
+            save_jobs(df_jobs, args.output)
+            if not args.no_archive:
+                from archive import archive_run # pyarrow is only required to archive
+                archive_run(df_jobs, run=args.coordinate)
+            sys.exit(0)
+
+    # Clean and create processed geoId data (if raw data changed)
+    df_geoId = clean_data_geoId(GEOID_CSV, GEOID_ARTIFACT)
+
+    if args.dry_run:
+        plan_searches(args.batch if args.batch is not None else [args.parameters], args.max_requests, args.deadline, stream=args.stream)
+        sys.exit(0)
+
+    if args.batch is not None:
+        run_batch(args.batch, args.output_dir, deadline=args.deadline, archive=not args.no_archive, max_requests=args.max_requests, resume=args.resume)
+        sys.exit(0)
 
     # Scraping parameters
-    json_jobs_parameters = "../../data/jobs_parameters_user_request.json"
+    json_jobs_parameters = args.parameters
     jobs_parameters = read_jobs_parameters(json_jobs_parameters)
     print("\nJobs parameters user request received", jobs_parameters, "\n")
-    df_jobs = scrape_jobs(jobs_parameters)
 
-    # Save jobs as csv file
-    filename_csv = "../../data/jobs.csv"
-    save_df2csv(df_jobs, filename_csv)
+    # Checkpoint of the requested search: --resume finds it even if the search is trimmed to other pages
+    checkpoint_filename = get_checkpoint_filename(jobs_parameters)
 
-    # Save jobs as json file
-    csv_filename = filename_csv
-    json_filename = filename_csv.replace("csv","json")
-    convert_csv2json(csv_filename, json_filename)
+    # Oversized searches are trimmed (fewer pages by city) or rejected before the first request
+    try:
+        pages, estimate = fit_plan(jobs_parameters, args.max_requests, args.deadline)
+    except ValueError as e:
+        print(">> {}".format(e))
+        if args.stream:
+            emit_event('plan', requested_pages=jobs_parameters['pages'], error=str(e))
+        sys.exit(1)
+    if pages < jobs_parameters['pages']:
+        print(">> Search trimmed to {} pages by city ({} requested)".format(pages, jobs_parameters['pages']))
+        jobs_parameters['pages'] = pages
+    if args.queue is not None and args.enqueue:
+        print("RUN: '{}'".format(enqueue_jobs_run(queue, jobs_parameters, deadline=args.deadline)))
+        sys.exit(0)
+    set_run_deadline(args.deadline)
+    if args.stream:
+        emit_event('start', pages_total=len(create_grid(jobs_parameters)))
+        df_jobs = scrape_jobs(jobs_parameters, on_page=emit_page, checkpoint_filename=checkpoint_filename, resume=args.resume)
+    else:
+        df_jobs = scrape_jobs(jobs_parameters, checkpoint_filename=checkpoint_filename, resume=args.resume)
+
+    # Save jobs as csv and json files
+    save_jobs(df_jobs, args.output)
+
+    # Append jobs to the archive (history of runs)
+    if not args.no_archive:
+        from archive import archive_run # pyarrow is only required to archive
+        archive_run(df_jobs)
+
+    # Run completed: next run of the same request starts from scratch (skipped pages are scraped by --resume)
+    if df_jobs.attrs.get('skipped_pages', 0) == 0:
+        os.remove(checkpoint_filename)
+    else:
+        print(">> {} pages skipped, run again with --resume to scrap them".format(df_jobs.attrs['skipped_pages']))
+    if args.stream:
+        emit_event('done', total=len(df_jobs))
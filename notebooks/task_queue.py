@@ -0,0 +1,175 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+
+#######################################################
+# Durable task queue (SQLite backend)
+#######################################################
+
+class TaskQueue:
+    """ Durable work queue shared by worker processes (and hosts sharing the SQLite file)
+    Tasks are leased for `visibility_timeout` seconds: a task whose worker died is leased again
+    once its lease expires, until `max_attempts` is reached.
+    Attributes:
+        db_filename: String, SQLite filename
+        visibility_timeout: Integer, lease duration in seconds
+        max_attempts: Integer, number of leases before a task is failed
+    """
+
+    def __init__(self, db_filename, visibility_timeout=300, max_attempts=3):
+        self.db_filename = db_filename
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        with closing(self.connect()) as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS run (
+                    id TEXT PRIMARY KEY,
+                    parameters TEXT,
+                    created_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS task (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    run TEXT,
+                    kind TEXT,
+                    payload TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    lease_until REAL,
+                    worker TEXT,
+                    result TEXT,
+                    error TEXT,
+                    updated_at REAL,
+                    UNIQUE (run, kind, payload)
+                );
+                CREATE INDEX IF NOT EXISTS task_status ON task (status, lease_until);
+            """)
+
+    def connect(self):
+        """ Open connection (autocommit, transactions are explicit) """
+        connection = sqlite3.connect(self.db_filename, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def create_run(self, parameters):
+        """ Create run
+        Args:
+            parameters: Dictionary, run parameters (json serializable)
+        Returns:
+            run: String, run id
+        """
+        run = uuid.uuid4().hex
+        with closing(self.connect()) as connection:
+            connection.execute("INSERT INTO run (id, parameters, created_at) VALUES (?, ?, ?)", (run, json.dumps(parameters), time.time()))
+        return run
+
+    def get_run_parameters(self, run):
+        with closing(self.connect()) as connection:
+            row = connection.execute("SELECT parameters FROM run WHERE id = ?", (run,)).fetchone()
+        return json.loads(row['parameters'])
+
+    def enqueue(self, run, kind, payload):
+        """ Add task (ignored if the same task already exists in the run)
+        Args:
+            run: String, run id
+            kind: String, task kind
+            payload: Dictionary, task arguments (json serializable)
+        Returns:
+            None
+        """
+        with closing(self.connect()) as connection:
+            connection.execute("INSERT OR IGNORE INTO task (run, kind, payload, updated_at) VALUES (?, ?, ?, ?)",
+                               (run, kind, json.dumps(payload, sort_keys=True), time.time()))
+
+    def lease(self, worker=None, kinds=None):
+        """ Lease the oldest available task (pending, or leased with an expired lease)
+        Args:
+            worker: String, worker name
+            kinds: Array of strings, task kinds to lease (all kinds if None)
+        Returns:
+            task: Dictionary, contains id, run, kind and payload (None if no task is available)
+        """
+        worker = worker if worker is not None else "{}:{}".format(socket.gethostname(), os.getpid())
+        now = time.time()
+        query = "SELECT id, run, kind, payload, attempts FROM task WHERE (status = 'pending' OR (status = 'leased' AND lease_until < ?))"
+        args = [now]
+        if kinds is not None:
+            query += " AND kind IN ({})".format(", ".join(["?"] * len(kinds)))
+            args += list(kinds)
+        query += " ORDER BY id LIMIT 1"
+
+        connection = self.connect()
+        try:
+            # Exclusive write lock: two workers cannot lease the same task
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(query, args).fetchone()
+            while row is not None and row['attempts'] >= self.max_attempts:
+                connection.execute("UPDATE task SET status = 'failed', error = coalesce(error, 'lease expired'), updated_at = ? WHERE id = ?", (now, row['id']))
+                row = connection.execute(query, args).fetchone()
+            task = None
+            if row is not None:
+                connection.execute("UPDATE task SET status = 'leased', attempts = attempts + 1, lease_until = ?, worker = ?, updated_at = ? WHERE id = ?",
+                                   (now + self.visibility_timeout, worker, now, row['id']))
+                task = {'id': row['id'], 'run': row['run'], 'kind': row['kind'], 'payload': json.loads(row['payload'])}
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        return task
+
+    def complete(self, task_id, result):
+        with closing(self.connect()) as connection:
+            connection.execute("UPDATE task SET status = 'done', result = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                               (json.dumps(result), time.time(), task_id))
+
+    def fail(self, task_id, error):
+        """ Release task after an error (failed after max_attempts leases) """
+        with closing(self.connect()) as connection:
+            connection.execute("""UPDATE task SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                  error = ?, lease_until = NULL, updated_at = ? WHERE id = ?""",
+                               (self.max_attempts, str(error), time.time(), task_id))
+
+    def stats(self, run=None):
+        """ Count tasks by status
+        Args:
+            run: String, run id (all runs if None)
+        Returns:
+            stats: Dictionary, {status: number of tasks}
+        """
+        query = "SELECT status, count(*) AS nb FROM task"
+        args = []
+        if run is not None:
+            query += " WHERE run = ?"
+            args.append(run)
+        with closing(self.connect()) as connection:
+            rows = connection.execute(query + " GROUP BY status", args).fetchall()
+        stats = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        stats.update({row['status']: row['nb'] for row in rows})
+        return stats
+
+    def is_finished(self, run=None):
+        stats = self.stats(run)
+        return stats['pending'] == 0 and stats['leased'] == 0
+
+    def results(self, run, kind):
+        """ Get results of done tasks
+        Args:
+            run: String, run id
+            kind: String, task kind
+        Returns:
+            results: Array of tuples, contains (payload, result)
+        """
+        with closing(self.connect()) as connection:
+            rows = connection.execute("SELECT payload, result FROM task WHERE run = ? AND kind = ? AND status = 'done' ORDER BY id", (run, kind)).fetchall()
+        results = [(json.loads(row['payload']), json.loads(row['result'])) for row in rows]
+        return results
@@ -0,0 +1,32 @@
+""" Benchmark of the card parsing (parse_cards) on the fixture pages
+$ python tests/benchmark_parse_cards.py --repeat 200
+"""
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+from conftest import read_fixture
+import scraping_jobs
+
+
+JOBS_PARAMETERS = {'title_keywords_must': {'data'}, 'title_keywords_excluded': {'senior'}}
+PAGES = [('Indeed', "indeed_page.html"), ('LinkedIn', "linkedin_page.html")]
+
+
+def benchmark(repeat):
+    """ Print the mean parsing time of each fixture page (soup parsing excluded) """
+    for website, filename in PAGES:
+        soup = BeautifulSoup(read_fixture(filename), 'html.parser')
+        started_at = time.perf_counter()
+        for _ in range(repeat):
+            job_tab = scraping_jobs.parse_cards(website, 'FRANCE', "https://example.com/jobs", soup, JOBS_PARAMETERS, fetched_at=0)
+        seconds = (time.perf_counter() - started_at) / repeat
+        print("{:<10} {:>4} jobs  {:>8.3f} ms/page".format(website, len(job_tab), seconds*1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the card parsing")
+    parser.add_argument('--repeat', type=int, default=200, help="parsings by page (default: %(default)s)")
+    args = parser.parse_args()
+    benchmark(args.repeat)
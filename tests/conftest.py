@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+NOTEBOOKS_DIR = os.path.join(os.path.dirname(__file__), "..", "notebooks")
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+sys.path.insert(0, NOTEBOOKS_DIR)
+
+
+def read_fixture(filename):
+    with open(os.path.join(FIXTURES_DIR, filename), "r", encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture
+def jobs_parameters():
+    return {'website': ['Indeed', 'LinkedIn'], 'query': 'data', 'location': ['Paris'], 'distance': 0, 'pages': 2,
+            'title_keywords_must': {'data'}, 'title_keywords_excluded': {'senior'}, 'title_keywords_ordered': {'junior'},
+            'company_size_type': {'Startup (1-10 employees)': True}, 'enrichment': 'inline', 'posted_after': None}
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import scraping_jobs
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    os.environ["DATABASE_URI"] = "sqlite:///{}".format(tmp_path_factory.mktemp("app") / "db.sqlite")
+    sys.path.insert(0, APP_DIR)
+    import app as app_module
+    app_module.scheduler = "off" # no saved searches thread in tests
+    with app_module.app.app_context():
+        app_module.create_tables()
+    yield app_module
+    sys.path.remove(APP_DIR)
+    del os.environ["DATABASE_URI"]
+
+
+def create_job(title, company_type="Unknown"):
+    return {'Website': 'Indeed', 'General rating': 0, 'Title': title, 'Company': 'ACME', 'Company_type': company_type,
+            'Company_sector': 'Data', 'Country': 'FRANCE', 'Country_code': 'fr', 'City': 'Paris', 'Summary': '',
+            'Posted_at': time.time(), 'Job_id': title, 'Job_url': '', 'Sources': ''}
+
+
+def test_sql_rating_matches_scraper_rating_on_accented_titles(app_module):
+    titles = ["INGÉNIEUR DATA Élève", "Ingénieur data", "Data Engineer", "ÉTUDIANT Stagiaire"]
+    jobs_parameters = {'title_keywords_ordered': ['ingénieur', 'élève', 'Étudiant', 'data'], 'company_size_type': {}}
+    with app_module.app.app_context():
+        run = app_module.Run(run_status="done", run_started_at=time.time(), run_updated_at=time.time())
+        app_module.db.session.add(run)
+        app_module.db.session.commit()
+        app_module.add_jobs([create_job(title) for title in titles], run)
+        app_module.rerank_jobs(jobs_parameters)
+        sql_ratings = {job.job_title: job.job_rating for job in app_module.Job.query.all()}
+
+    keywords = [word.lower() for word in jobs_parameters['title_keywords_ordered']]
+    assert sql_ratings == {title: scraping_jobs.rate_title(title, keywords) for title in titles}
+    assert sql_ratings["INGÉNIEUR DATA Élève"] == 3
+
+
+def test_top_k_is_capped(app_module):
+    with app_module.app.app_context():
+        app_module.add_jobs([create_job("Job {}".format(i)) for i in range(app_module.TOP_MAX_K + 5)], app_module.get_last_run())
+    response = app_module.app.test_client().get("/top?k=100000")
+    assert len(response.get_json()) == app_module.TOP_MAX_K
+
+
+def get_etag_in_new_process(app_module):
+    """ ETag of /api/jobs served by another worker process (same database) """
+    script = "import app; app.scheduler = 'off'; print(app.app.test_client().get('/api/jobs').headers['ETag'])"
+    env = dict(os.environ, DATABASE_URI=app_module.app.config['SQLALCHEMY_DATABASE_URI'])
+    output = subprocess.run([sys.executable, "-c", script], cwd=APP_DIR, env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return output.strip().splitlines()[-1]
+
+
+def test_jobs_validators_change_with_any_job_write(app_module):
+    client = app_module.app.test_client()
+    etag = client.get("/api/jobs").headers["ETag"]
+    assert client.get("/api/jobs", headers={"If-None-Match": etag}).status_code == 304
+    assert get_etag_in_new_process(app_module) == etag
+
+    # Job written by another process (no run, no state of this process): the version row is bumped by the triggers
+    database = app_module.app.config['SQLALCHEMY_DATABASE_URI'][len("sqlite:///"):]
+    connection = sqlite3.connect(database)
+    connection.execute("UPDATE job SET job_rating = job_rating + 1 WHERE id = (SELECT min(id) FROM job)")
+    connection.commit()
+    connection.close()
+    response = client.get("/api/jobs", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert client.get("/api/jobs", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_due_search_is_run_by_one_worker(app_module, tmp_path, monkeypatch):
+    scraped = []
+    def run_scraper(run_id, parameters_filename, output_filename):
+        scraped.append(run_id)
+        app_module.Run.query.filter_by(id=run_id).update({app_module.Run.run_status: "done"})
+        app_module.db.session.commit()
+        return "done"
+    def run_due_search_in_worker():
+        with app_module.app.app_context():
+            app_module.run_due_search()
+    # Another worker process polls while this one prepares the run of the due search
+    makedirs = os.makedirs
+    def makedirs_during_poll(*args, **kwargs):
+        if len(scraped) == 0:
+            worker = threading.Thread(target=run_due_search_in_worker)
+            worker.start()
+            worker.join()
+        return makedirs(*args, **kwargs)
+    monkeypatch.setattr(app_module, 'run_scraper', run_scraper)
+    monkeypatch.setattr(app_module, 'SEARCHES_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module.os, 'makedirs', makedirs_during_poll)
+
+    with app_module.app.app_context():
+        search = app_module.SavedSearch(search_name="data", search_parameters="{}", search_interval=3600, search_next_run_at=time.time() - 1)
+        app_module.db.session.add(search)
+        app_module.db.session.commit()
+        run = app_module.run_due_search()
+        assert app_module.run_due_search() is None # next run in an hour
+        assert scraped == [run.id]
+        assert app_module.Run.query.filter_by(run_search=search.id).count() == 1
+        app_module.db.session.delete(search)
+        app_module.db.session.commit()
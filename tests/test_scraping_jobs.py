@@ -0,0 +1,190 @@
+import os
+
+from bs4 import BeautifulSoup
+
+import scraping_jobs
+from conftest import read_fixture
+
+
+def parse_fixture(website, filename, jobs_parameters):
+    soup = BeautifulSoup(read_fixture(filename), 'html.parser')
+    stats = {}
+    job_tab = scraping_jobs.parse_cards(website, 'FRANCE', "https://example.com/jobs?q=data", soup, jobs_parameters, fetched_at=1000000, stats=stats)
+    return job_tab, stats
+
+
+def test_parse_cards_indeed_skips_rejected_cards_with_missing_fields(jobs_parameters):
+    job_tab, stats = parse_fixture('Indeed', "indeed_page.html", jobs_parameters)
+    assert stats['cards'] == 18
+    assert [job.Job_id for job in job_tab] == ["jk{}".format(i) for i in range(15)] + ["jkPartial"]
+    assert job_tab[0].Title == "Junior Data Scientist 0"
+    assert job_tab[0].Company == "ACME & CO"
+    assert job_tab[0].City == "Paris"
+
+    # Accepted card without salary and date
+    partial = job_tab[-1]
+    assert (partial.Company, partial.City, partial.Salary, partial.Summary) == ("UMBRELLA", "Lille", "", "Dashboards")
+    assert partial.Posted_at == 1000000
+    assert partial.Job_url == "https://example.com/jobs?q=data&vjk=jkPartial"
+
+
+def test_parse_cards_without_results(jobs_parameters):
+    # Page after the last results page, no-results page: no cards container
+    soup = BeautifulSoup("<html><body><p>No jobs found</p></body></html>", 'html.parser')
+    for website in ['Indeed', 'LinkedIn']:
+        stats = {}
+        assert scraping_jobs.parse_cards(website, 'FRANCE', "https://example.com/jobs?q=data", soup, jobs_parameters, fetched_at=1000000, stats=stats) == []
+        assert stats['cards'] == 0
+
+
+def test_parse_cards_linkedin_skips_rejected_cards_with_missing_fields(jobs_parameters):
+    job_tab, stats = parse_fixture('LinkedIn', "linkedin_page.html", jobs_parameters)
+    assert stats['cards'] == 27
+    assert len(job_tab) == 26
+    assert job_tab[1].Job_url == "https://www.linkedin.com/jobs/view/1"
+    assert job_tab[1].Posted_at == 1000000 - 2*7*24*3600
+
+    # Accepted card without location, date and url
+    partial = job_tab[-1]
+    assert (partial.Title, partial.Company, partial.City, partial.Job_id, partial.Job_url) == ("Data Engineer Intern", "VANDELAY", "", "901", "")
+
+
+def create_listing_page(cell):
+    """ LinkedIn listing page with 5 distinct jobs by cell """
+    website, country, city, page = cell
+    cards = "".join(["""<li><div class="base-card base-card--link base-search-card base-search-card--link job-search-card" data-entity-urn="urn:li:jobPosting:{city}{page}{i}">
+        <h3 class="base-search-card__title">Data Engineer {city} {page} {i}</h3><h4 class="base-search-card__subtitle">Company {city} {page} {i}</h4>
+        <span class="job-search-card__location">{city}</span><time>1 day ago</time></div></li>""".format(city=city, page=page, i=i) for i in range(5)])
+    return BeautifulSoup("<html><ul>{}</ul></html>".format(cards), 'html.parser')
+
+
+def test_resume_after_partial_checkpoint_line(tmp_path, monkeypatch, jobs_parameters):
+    grid = [('LinkedIn', 'FRANCE', city, page) for city in ['Paris', 'Lyon'] for page in range(3)]
+    fetched = []
+    def extract_data(website, country, city, page, jobs_parameters):
+        fetched.append((website, country, city, page))
+        return "https://example.com", create_listing_page((website, country, city, page)), 1000000
+    monkeypatch.setattr(scraping_jobs, 'create_grid', lambda jobs_parameters: grid)
+    monkeypatch.setattr(scraping_jobs, 'extract_data', extract_data)
+    monkeypatch.setattr(scraping_jobs, 'save_host_stats', lambda: None)
+    jobs_parameters = dict(jobs_parameters, website=['LinkedIn'], enrichment='deferred')
+    checkpoint_filename = str(tmp_path / "checkpoint.jsonl")
+
+    df_jobs = scraping_jobs.scrape_jobs(jobs_parameters, checkpoint_filename=checkpoint_filename)
+    assert len(df_jobs) == 30
+
+    # Crash during the write of the last page
+    with open(checkpoint_filename, "rb") as f:
+        content = f.read()
+    with open(checkpoint_filename, "wb") as f:
+        f.write(content[:-40])
+
+    # First resume: the partial page is scraped again, the second resume restores every page
+    for nb_fetched in [1, 0]:
+        fetched.clear()
+        df_jobs = scraping_jobs.scrape_jobs(jobs_parameters, checkpoint_filename=checkpoint_filename, resume=True)
+        assert len(fetched) == nb_fetched
+        assert len(df_jobs) == 30
+    assert set(scraping_jobs.load_checkpoint(checkpoint_filename)) == set(grid)
+
+
+def test_resume_replays_page_cards_into_budget(tmp_path, monkeypatch, jobs_parameters):
+    grid = [('LinkedIn', 'FRANCE', city, page) for city in ['Paris', 'Lyon'] for page in range(2)]
+    records = []
+    record = scraping_jobs.PageBudget.record
+    def record_spy(budget, cell, cards, jobs):
+        records.append((cell, cards, jobs))
+        record(budget, cell, cards, jobs)
+    monkeypatch.setattr(scraping_jobs, 'create_grid', lambda jobs_parameters: grid)
+    monkeypatch.setattr(scraping_jobs, 'extract_data', lambda website, country, city, page, jobs_parameters: ("https://example.com", create_listing_page((website, country, city, page)), 1000000))
+    monkeypatch.setattr(scraping_jobs, 'save_host_stats', lambda: None)
+    monkeypatch.setattr(scraping_jobs.PageBudget, 'record', record_spy)
+    jobs_parameters = dict(jobs_parameters, website=['LinkedIn'], enrichment='deferred', title_keywords_excluded=['Lyon'])
+    checkpoint_filename = str(tmp_path / "checkpoint.jsonl")
+
+    # Cards of Lyon pages are rejected by the title filter: the budget sees 5 cards and 0 jobs, on resume too
+    scraping_jobs.scrape_jobs(jobs_parameters, checkpoint_filename=checkpoint_filename)
+    scraped_records = sorted(records)
+    records.clear()
+    scraping_jobs.scrape_jobs(jobs_parameters, checkpoint_filename=checkpoint_filename, resume=True)
+    assert sorted(records) == scraped_records
+    assert (('LinkedIn', 'FRANCE', 'Lyon', 0), 5, 0) in scraped_records
+
+
+def test_page_budget_never_exceeds_the_grid_of_a_host():
+    grid = [(website, 'FRANCE', city, page) for website in ['Indeed', 'LinkedIn'] for city in ['Paris', 'Lyon'] for page in range(2)]
+    budget = scraping_jobs.PageBudget(grid)
+    fetched = {'Indeed': 0, 'LinkedIn': 0}
+
+    # Indeed pages are empty: the pages it saves are not given to LinkedIn (listing requests of the plan are an upper bound)
+    for cell in budget.cells():
+        fetched[cell[0]] += 1
+        nb_cards = 0 if cell[0] == 'Indeed' else 10
+        budget.record(cell, nb_cards, nb_cards)
+    assert fetched == {'Indeed': 2, 'LinkedIn': 4}
+    assert budget.get_remaining() == 0
+
+
+class StubResponse:
+    def __init__(self, url, status_code, text):
+        self.url, self.status_code, self.content, self.headers = url, status_code, text.encode('utf-8'), {}
+
+
+def test_resolve_company_tries_next_slug_after_404(tmp_path, monkeypatch):
+    company_page = '<html><code>{"staffCountRange": {"start": 11, "end": 50}, "specialities": ["Data", "Cloud"]}</code></html>'
+    requested = []
+    def get(url, headers=None, timeout=None):
+        requested.append(url)
+        if "/company/acme/" in url:
+            return StubResponse(url, 200, company_page)
+        return StubResponse(url, 404, "<html>Page not found</html>")
+    work_dir = tmp_path / "a" / "b"
+    work_dir.mkdir(parents=True)
+    monkeypatch.chdir(work_dir)
+    monkeypatch.setattr(scraping_jobs.requests, 'get', get)
+    monkeypatch.setattr(scraping_jobs, 'company_index', {})
+    monkeypatch.setattr(scraping_jobs, 'HEDGE_DELAY', None)
+
+    # 404 pages of the first slugs are not parsed as company pages, nor cached
+    company = scraping_jobs.resolve_company("Acme Analytics SAS")
+    assert (company['slug'], company['type'], company['sector']) == ("acme", "Small-sized Enterprise (11-50 employees)", "Data, Cloud")
+    assert [url.split("/")[4] for url in requested] == ["acme-analytics-sas", "acme-analytics", "acme"]
+    assert sum([len(files) for _, _, files in os.walk(tmp_path / "data" / "cache" / "http" / "entries")]) == 1
+
+
+def test_queue_tasks_apply_posted_after_and_deadline(tmp_path, monkeypatch, jobs_parameters):
+    grid = [('LinkedIn', 'FRANCE', 'Paris', page) for page in range(2)]
+    def extract_data(website, country, city, page, jobs_parameters):
+        scraping_jobs.get_timeout() # run deadline is checked before each request
+        return "https://example.com", create_listing_page((website, country, city, page)), 1000000
+    monkeypatch.setattr(scraping_jobs, 'create_grid', lambda jobs_parameters: grid)
+    monkeypatch.setattr(scraping_jobs, 'extract_data', extract_data)
+    monkeypatch.setattr(scraping_jobs, 'run_deadline', None) # set by the tasks
+    queue = scraping_jobs.TaskQueue(str(tmp_path / "queue.sqlite"), max_attempts=1)
+    jobs_parameters = dict(jobs_parameters, website=['LinkedIn'], enrichment='deferred')
+
+    # Jobs posted 1 day before the page are older than the last run (delta run): none is emitted
+    delta_run = scraping_jobs.enqueue_jobs_run(queue, dict(jobs_parameters, posted_after=1000000 + 12*3600))
+    full_run = scraping_jobs.enqueue_jobs_run(queue, jobs_parameters)
+    late_run = scraping_jobs.enqueue_jobs_run(queue, jobs_parameters, deadline=-1)
+    scraping_jobs.run_worker(queue, poll=0)
+    assert [len(result['jobs']) for _, result in queue.results(delta_run, 'page')] == [0, 0]
+    assert [len(result['jobs']) for _, result in queue.results(full_run, 'page')] == [5, 5]
+    assert queue.stats(late_run)['failed'] == 2
+
+
+def test_fit_plan_counts_batch_pages_as_free(tmp_path, monkeypatch, jobs_parameters):
+    grid = [('Indeed', 'FRANCE', 'Paris', page) for page in range(4)]
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scraping_jobs, 'create_grid', lambda jobs_parameters: grid)
+    monkeypatch.setattr(scraping_jobs, 'host_stats', {'hosts': {}, 'sites': {}, 'companies': {}})
+    jobs_parameters = dict(jobs_parameters, website=['Indeed'], pages=4, enrichment='deferred')
+    assert scraping_jobs.fit_plan(jobs_parameters, max_requests=2, max_seconds=None)[0] == 2
+
+    # Pages fetched by a previous search of the batch are not requested again
+    adapter = scraping_jobs.get_site_adapter('Indeed')
+    memo = {adapter.create_url(country, city, page, jobs_parameters): (b"", 1000000) for website, country, city, page in grid}
+    monkeypatch.setattr(scraping_jobs, 'listing_memo', memo)
+    pages, estimate = scraping_jobs.fit_plan(jobs_parameters, max_requests=2, max_seconds=None)
+    assert pages == 4
+    assert estimate['fr.indeed.com']['requests'] == 0